@@ -0,0 +1,64 @@
+#!/usr/bin/python
+"""Compare util.parse_date_from_file with plain strptime over a synthetic log.
+
+Usage: python bench/bench_parse_date.py [--lines N] [--seed N]
+"""
+
+from argparse import ArgumentParser
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cuttime import util
+
+
+def synthetic_timestamps(num_lines, seed):
+    """Return the timestamp strings of a log with *num_lines* lines, alternating
+    clockins and clockouts, where about a third of clockins happen at the same
+    second as the previous clockout
+    """
+    rand = random.Random(seed)
+    t = datetime.datetime(2010, 1, 1, 9)
+    stamps = []
+    for i in xrange(num_lines):
+        if i % 2 == 0 and rand.random() < 0.66:
+            t += datetime.timedelta(seconds=rand.randint(1, 16 * 3600))
+        elif i % 2 == 1:
+            t += datetime.timedelta(seconds=rand.randint(60, 4 * 3600))
+        stamps.append(t.strftime(util.file_date_format) + '\n')
+    return stamps
+
+
+def timed(func, stamps):
+    start = time.time()
+    results = [func(stamp) for stamp in stamps]
+    return time.time() - start, results
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    stamps = synthetic_timestamps(args.lines, args.seed)
+
+    strptime_time, expected = timed(
+        lambda s: datetime.datetime.strptime(s.strip(), util.file_date_format), stamps)
+    fast_time, results = timed(util.parse_date_from_file, stamps)
+
+    if results != expected:
+        print 'MISMATCH: parse_date_from_file disagrees with strptime'
+        sys.exit(1)
+
+    print '%d lines' % args.lines
+    print 'strptime:             %7.3fs' % strptime_time
+    print 'parse_date_from_file: %7.3fs (%.1fx)' % (fast_time, strptime_time / fast_time)
+
+
+if __name__ == '__main__':
+    main()
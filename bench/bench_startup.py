@@ -0,0 +1,79 @@
+#!/usr/bin/python
+"""Time how long ct clockin and ct summary take from process start to exit.
+
+Usage: python bench/bench_startup.py [--runs N]
+
+Each command runs in a fresh interpreter against a small temporary $CT_HOME,
+so the numbers are dominated by imports and argument parsing. Also lists which
+of the slow optional modules each command ended up importing.
+"""
+
+from argparse import ArgumentParser
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+import loggen
+
+slow_modules = ['dateutil', 'multiprocessing']
+
+# Runs ct in-process and reports which slow modules it imported
+probe = """
+import sys
+sys.argv = ['ct'] + sys.argv[1:]
+from cuttime import main
+main()
+sys.stderr.write('imported: ' + ' '.join(m for m in SLOW_MODULES if m in sys.modules) + '\\n')
+""".replace('SLOW_MODULES', repr(slow_modules))
+
+commands = [
+    ['clockin', 'ct'],
+    ['clockout'],
+    ['summary', '--format', 'csv'],
+    ['summary', '--from', '2010-01-01', '--to', '2010-02-01', '--format', 'csv'],
+]
+
+
+def run(home, ct_args):
+    env = dict(os.environ, CT_HOME=home, PYTHONPATH=root)
+    start = time.time()
+    output = subprocess.check_output([sys.executable, '-c', probe] + ct_args,
+                                     env=env, stderr=subprocess.STDOUT)
+    return time.time() - start, output
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    home = tempfile.mkdtemp(prefix='ct-bench-')
+    try:
+        loggen.write_home(home, users=1, days=30)
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', 'pass'])
+        baseline = time.time() - start
+        print 'bare interpreter: %6.1fms' % (baseline * 1000)
+
+        for ct_args in commands:
+            times = []
+            for _ in xrange(args.runs):
+                elapsed, output = run(home, ct_args)
+                times.append(elapsed)
+            times.sort()
+            imported = [line for line in output.splitlines() if line.startswith('imported:')]
+            print 'ct %-58s %6.1fms median  (%s)' % (
+                ' '.join(ct_args), times[len(times) // 2] * 1000,
+                imported[-1] if imported else '')
+    finally:
+        shutil.rmtree(home)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+#!/usr/bin/python
+"""Time every summary format and date range, and clockin/clockout, over a
+generated $CT_HOME, and save the results as JSON.
+
+Usage: python bench/bench_suite.py [--users N] [--days N] [--projects N]
+           [--intervals-per-day N] [--seed N] [--runs N] [--output FILE]
+           [--compare FILE]
+
+The generated logs end yesterday, so --week and recent ranges have data to
+report; pass --start to generate exactly the same logs on another day. Each
+case runs ct in a fresh process: once right after the sidecar caches are
+removed (cold), then --runs more times with them in place (warm). --output
+writes the results as JSON, and --compare prints the change in warm medians
+from the results of an earlier run, e.g. on another commit.
+"""
+
+from argparse import ArgumentParser
+import datetime
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+import loggen
+
+formats = ['pretty', 'weekly', 'csv', 'tsv', 'json', 'jsonl']
+
+aggregate_formats = ['pretty', 'csv', 'tsv']
+
+
+def date_ranges(start, days):
+    """Return (name, summary arguments) for every kind of --from/--to range over
+    a log of *days* days starting at *start*. Times are in the middle of a day,
+    so days cut in two are covered too.
+    """
+    def arg(day, hour):
+        return (start + datetime.timedelta(days=day, hours=hour)).strftime('%Y-%m-%dT%H:%M')
+    return [('all', []),
+            ('from', ['--from', arg(days - 30, 13)]),
+            ('to', ['--to', arg(min(30, days), 13)]),
+            ('from-to', ['--from', arg(days // 2, 13), '--to', arg(days // 2 + 30, 11)])]
+
+
+def cases(start, days):
+    """Return (name, ct arguments) for every case to time"""
+    result = []
+    for range_name, range_args in date_ranges(start, days):
+        for format_name in formats:
+            result.append(('summary %s %s' % (format_name, range_name),
+                           ['summary', '--format', format_name] + range_args))
+        for format_name in aggregate_formats:
+            result.append(('summary aggregate %s %s' % (format_name, range_name),
+                           ['summary', '--aggregate', '--format', format_name] + range_args))
+    result.append(('summary week', ['summary', '--week']))
+    result.append(('summary period month', ['summary', '--period', 'month']))
+    result.append(('summary period 14d weekly', ['summary', '--period', '14d',
+                                                 '--format', 'weekly']))
+    result.append(('status', ['status']))
+    return result
+
+
+def run(home, ct_args):
+    """Run ct once and return (seconds, exit status, last line of output)"""
+    env = dict(os.environ, CT_HOME=home, PYTHONPATH=root)
+    start = time.time()
+    process = subprocess.Popen([sys.executable, os.path.join(root, 'bin', 'ct')] + ct_args,
+                               env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.communicate()[0]
+    elapsed = time.time() - start
+    lines = output.strip().splitlines()
+    return elapsed, process.returncode, lines[-1] if lines else ''
+
+
+def remove_sidecars(home):
+    for path in glob.glob(os.path.join(home, '.*')):
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def stats(times):
+    times = sorted(times)
+    return dict(runs=len(times), min=times[0], median=times[len(times) // 2], max=times[-1])
+
+
+def time_case(home, name, ct_args, runs):
+    """Time one case cold and then *runs* times warm, and return its result"""
+    remove_sidecars(home)
+    cold, status, last_line = run(home, ct_args)
+    warm = []
+    for _ in xrange(runs):
+        elapsed, status, last_line = run(home, ct_args)
+        warm.append(elapsed)
+    result = dict(name=name, argv=ct_args, cold=cold, warm=stats(warm), status=status)
+    if status:
+        result['error'] = last_line
+    return result
+
+
+def time_actions(home, runs):
+    """Time alternating clockins and clockouts, and return a result for each"""
+    times = dict(clockin=[], clockout=[])
+    status = dict(clockin=0, clockout=0)
+    for _ in xrange(runs):
+        for name, ct_args in (('clockin', ['clockin', 'ct']), ('clockout', ['clockout'])):
+            elapsed, returncode, _ = run(home, ct_args)
+            times[name].append(elapsed)
+            status[name] = status[name] or returncode
+    return [dict(name=name, argv=ct_args, warm=stats(times[name]), status=status[name])
+            for name, ct_args in (('clockin', ['clockin', 'ct']), ('clockout', ['clockout']))]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=root,
+                                       stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(result, previous=None):
+    line = '%-40s' % result['name']
+    line += ' cold %7.1fms' % (result['cold'] * 1000) if 'cold' in result else ' ' * 15
+    line += '  warm %7.1fms' % (result['warm']['median'] * 1000)
+    if previous is not None:
+        line += '  %+6.1f%%' % ((result['warm']['median'] / previous['warm']['median'] - 1) * 100)
+    if result['status']:
+        line += '  FAILED: %s' % result.get('error', 'exit status %d' % result['status'])
+    print line
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--days', type=int, default=730)
+    parser.add_argument('--projects', type=int, default=len(loggen.default_projects))
+    parser.add_argument('--intervals-per-day', dest='intervals_per_day', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--start', default=None,
+                        help='first day of the logs, as YYYY-mm-dd (default: --days days ago)')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', default=None, help='file to write the results to as JSON')
+    parser.add_argument('--compare', default=None,
+                        help='JSON results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    if args.start:
+        start = datetime.datetime.strptime(args.start, '%Y-%m-%d')
+    else:
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        start = today - datetime.timedelta(days=args.days)
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = dict((result['name'], result) for result in json.load(f)['results'])
+
+    home = tempfile.mkdtemp(prefix='ct-bench-')
+    try:
+        loggen.write_home(home, args.users, args.days, loggen.project_names(args.projects),
+                          args.intervals_per_day, args.seed, start)
+        print '%d users, %d days from %s, %d projects, up to %d intervals a day' % (
+            args.users, args.days, start.strftime('%Y-%m-%d'), args.projects,
+            args.intervals_per_day)
+
+        results = []
+        for name, ct_args in cases(start, args.days):
+            results.append(time_case(home, name, ct_args, args.runs))
+            print_result(results[-1], previous.get(name))
+        for result in time_actions(home, args.runs):
+            results.append(result)
+            print_result(result, previous.get(result['name']))
+    finally:
+        shutil.rmtree(home)
+
+    if args.output:
+        report = dict(commit=git_commit(), python=platform.python_version(),
+                      time=datetime.datetime.now().isoformat(),
+                      params=dict(users=args.users, days=args.days, projects=args.projects,
+                                  intervals_per_day=args.intervals_per_day, seed=args.seed,
+                                  start=start.strftime('%Y-%m-%d'), runs=args.runs),
+                      results=results)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print 'Wrote %s' % args.output
+
+    if any(result['status'] for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
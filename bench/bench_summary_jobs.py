@@ -0,0 +1,67 @@
+#!/usr/bin/python
+"""Time ct summary --jobs N over a generated multi-user $CT_HOME.
+
+Usage: python bench/bench_summary_jobs.py [--users N] [--days N] [--jobs 1,2,4]
+
+Sidecar caches are removed before every run, so each run parses every log.
+Output of every run is checked against the serial run.
+"""
+
+from argparse import ArgumentParser
+from multiprocessing import cpu_count
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+import loggen
+
+
+def run_summary(home, jobs, extra_args):
+    for path in glob.glob(os.path.join(home, '.*')):
+        os.remove(path)
+    env = dict(os.environ, CT_HOME=home, PYTHONPATH=root)
+    start = time.time()
+    output = subprocess.check_output(
+        [sys.executable, os.path.join(root, 'bin', 'ct'), 'summary',
+         '--jobs', str(jobs)] + extra_args,
+        env=env, stderr=subprocess.STDOUT)
+    return time.time() - start, output
+
+
+def main():
+    default_jobs = sorted(set([1, 2, 4, cpu_count()]))
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--jobs', default=','.join(map(str, default_jobs)))
+    parser.add_argument('--format', default='csv')
+    args = parser.parse_args()
+
+    home = tempfile.mkdtemp(prefix='ct-bench-')
+    try:
+        loggen.write_home(home, args.users, args.days, seed=args.seed)
+        print '%d users, %d days each, %d cores' % (args.users, args.days, cpu_count())
+
+        serial_time, expected = None, None
+        for jobs in [int(j) for j in args.jobs.split(',')]:
+            elapsed, output = run_summary(home, jobs, ['--format', args.format])
+            if expected is None:
+                serial_time, expected = elapsed, output
+            elif output != expected:
+                print 'MISMATCH: --jobs %d output differs from --jobs 1' % jobs
+                sys.exit(1)
+            print '--jobs %-3d %7.3fs (%.2fx)' % (jobs, elapsed, serial_time / elapsed)
+    finally:
+        shutil.rmtree(home)
+
+
+if __name__ == '__main__':
+    main()
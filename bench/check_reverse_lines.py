@@ -0,0 +1,118 @@
+#!/usr/bin/python
+"""Check that reading a log backwards finds the same lines, last project and
+open clockin as reading it forwards.
+
+Usage: python bench/check_reverse_lines.py [--block-sizes N,N,...]
+
+Runs util.reverse_lines, util.last_project and the text storage's clocked_in and
+last_project on logs with and without a trailing newline, with blank lines, with
+no clockin at all and with no log at all, reading them backwards a few bytes at
+a time as well as in whole blocks.
+"""
+
+from argparse import ArgumentParser
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+from cStringIO import StringIO
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+import loggen
+from cuttime import storage, util
+
+start = datetime.datetime(2024, 3, 1, 9)
+
+
+def clockin(project, hours):
+    return util.format_clockin(project, start + datetime.timedelta(hours=hours))
+
+
+def clockout(hours):
+    return util.format_clockout(start + datetime.timedelta(hours=hours))
+
+
+def cases():
+    """Return (name, log text) for each log to check, None meaning no log"""
+    closed = clockin('alpha', 0) + clockout(1) + clockin('beta', 2) + clockout(3)
+    open_ = closed + clockin('gamma', 4)
+    return [('open, trailing newline', open_),
+            ('open, partial last line', open_.rstrip('\n')),
+            ('open, blank lines after', open_ + '\n  \n\n'),
+            ('closed, trailing newline', closed),
+            ('closed, partial last line', closed.rstrip('\n')),
+            ('blank lines between', closed.replace('\n', '\n\n')),
+            ('one clockin, no newline', clockin('alpha', 0).rstrip('\n')),
+            ('no clockin', clockout(1) + clockout(2)),
+            ('only blank lines', '\n \n\n'),
+            ('empty', ''),
+            ('no log', None)]
+
+
+def expected(text):
+    """Return (non-blank lines last to first, last project, clocked in), found by
+    reading *text* forwards
+    """
+    lines = [line for line in (text or '').split('\n') if line.strip()]
+    projects = [util.parse_clockin(line)[0] for line in lines]
+    projects = [project for project in projects if project]
+    clocked_in = (None, None)
+    if lines and 'clockin' in lines[-1]:
+        clocked_in = util.parse_clockin(lines[-1])
+    return list(reversed(lines)), projects[-1] if projects else None, clocked_in
+
+
+def check(home, name, text, block_size):
+    """Return a list of the problems found with the log *text*"""
+    path = os.path.join(home, '%s.txt' % util.load_config()['name'])
+    if os.path.exists(path):
+        os.remove(path)
+    if text is not None:
+        with open(path, 'wb') as f:
+            f.write(text)
+
+    lines, last_project, clocked_in = expected(text)
+    store = storage.storage('text')
+    found = [('reverse_lines', list(util.reverse_lines(StringIO(text or ''), block_size)),
+              lines),
+             ('util.last_project', util.last_project(), last_project),
+             ('storage last_project', store.last_project(), last_project),
+             ('storage clocked_in', store.clocked_in(), clocked_in)]
+    return ['%s, block size %d: %s returned %r, not %r' % (name, block_size, what, got, wanted)
+            for what, got, wanted in found if got != wanted]
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--block-sizes', default='1,2,3,7,16,4096')
+    args = parser.parse_args()
+
+    home = tempfile.mkdtemp(prefix='ct-reverse-')
+    reverse_lines = util.reverse_lines
+    try:
+        loggen.write_home(home, users=0, days=0)
+        os.environ['CT_HOME'] = home
+        problems = []
+        block_sizes = [int(size) for size in args.block_sizes.split(',')]
+        for block_size in block_sizes:
+            # last_project and clocked_in read with the default block size
+            util.reverse_lines = lambda f, block_size=block_size: reverse_lines(f, block_size)
+            for name, text in cases():
+                problems.extend(check(home, name, text, block_size))
+        util.reverse_lines = reverse_lines
+
+        print '%d logs x %d block sizes' % (len(cases()), len(block_sizes))
+        for problem in problems:
+            print problem
+        print 'FAILED' if problems else 'OK'
+        sys.exit(1 if problems else 0)
+    finally:
+        util.reverse_lines = reverse_lines
+        shutil.rmtree(home)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/python
+"""Check that the text and SQLite storages give the same results.
+
+Usage: python bench/compare_storage.py [--users N] [--days N] [--seed N]
+
+Generates logs with some unusual intervals (crossing midnight, lasting no time,
+backdated), copies them to a second $CT_HOME and moves that one into SQLite with
+ct migrate. Then every summary case of bench_suite.py, with and without a
+project, and a series of clockins, clockouts and imports are run against both,
+and any difference in their output is printed.
+"""
+
+from argparse import ArgumentParser
+import datetime
+import difflib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+import bench_suite
+import loggen
+from cuttime import util
+
+# Lines added to the end of the first log, after the generated intervals
+unusual_lines = [
+    # Crosses two midnights
+    ('ct', 1, 22), ('clockout', 3, 2),
+    # Lasts no time, and ends before it starts
+    ('docs', 3, 5), ('clockout', 3, 5),
+    ('docs', 3, 6), ('clockout', 3, 4),
+    # Backdated into the generated intervals
+    ('support', -30, 3), ('clockout', -30, 4),
+]
+
+
+def write_homes(directory, users, days, seed, start):
+    """Write the same logs to text and sqlite homes in *directory*, and return
+    their paths
+    """
+    text_home = os.path.join(directory, 'text')
+    loggen.write_home(text_home, users, days, seed=seed, start=start)
+    with open(os.path.join(text_home, 'user0000.txt'), 'a') as f:
+        for name, day, hour in unusual_lines:
+            time = start + datetime.timedelta(days=days + day, hours=hour)
+            if name == 'clockout':
+                f.write(util.format_clockout(time))
+            else:
+                f.write(util.format_clockin(name, time))
+
+    sqlite_home = os.path.join(directory, 'sqlite')
+    shutil.copytree(text_home, sqlite_home)
+    run(sqlite_home, ['migrate'])
+    return text_home, sqlite_home
+
+
+def run(home, ct_args, stdin=None):
+    """Run ct and return everything it printed"""
+    env = dict(os.environ, CT_HOME=home, PYTHONPATH=root)
+    process = subprocess.Popen([sys.executable, os.path.join(root, 'bin', 'ct')] + ct_args,
+                               env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+    return process.communicate(stdin)[0]
+
+
+def actions(start, days):
+    """Return (ct arguments, stdin) for writes to make to both homes"""
+    def arg(day, hour):
+        return (start + datetime.timedelta(days=day, hours=hour)).strftime('%Y-%m-%d %H:%M')
+    return [(['clockin', 'billing', '--time', arg(days + 4, 9)], None),
+            (['clockin', 'infra', '--time', arg(days + 4, 10)], None),
+            (['toggle', '--time', arg(days + 4, 11)], None),
+            (['clockout', '--time', arg(days + 4, 12)], None),
+            (['clockin', '--time', arg(days + 4, 13)], None),
+            (['clockout', '--time', arg(days + 5, 1)], None),
+            (['import'], 'docs,%s,%s\n' % (arg(days + 6, 9), arg(days + 6, 10))),
+            (['import'], 'docs,%s,%s\n' % (arg(days // 2, 0), arg(days // 2, 1))),
+            (['import'], 'docs,%s,%s\n' % (arg(days + 6, 9), arg(days + 6, 11))),
+            # The project of the latest clockin, not of the last import
+            (['import'], 'meetings,%s,%s\n' % (arg(days // 3, 0), arg(days // 3, 1))),
+            (['clockin', '--time', arg(days + 7, 9)], None),
+            (['clockout', '--time', arg(days + 7, 10)], None)]
+
+
+def compare(name, text_output, sqlite_output):
+    """Print the difference between the outputs, and return True if they match"""
+    if text_output == sqlite_output:
+        return True
+    print 'DIFFERENT: %s' % name
+    for line in difflib.unified_diff(text_output.splitlines(), sqlite_output.splitlines(),
+                                     'text', 'sqlite', lineterm=''):
+        print '  %s' % line
+    return False
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=3)
+    parser.add_argument('--days', type=int, default=400)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    start = loggen.default_start
+
+    directory = tempfile.mkdtemp(prefix='ct-storage-')
+    try:
+        text_home, sqlite_home = write_homes(directory, args.users, args.days, args.seed,
+                                             start)
+        cases = bench_suite.cases(start, args.days)
+        cases += [(name + ' ct', ct_args + ['ct']) for name, ct_args in cases
+                  if ct_args[0] == 'summary']
+
+        same = 0
+        for round_name in ('before writes', 'after writes'):
+            for name, ct_args in cases:
+                same += compare('%s (%s)' % (name, round_name),
+                                run(text_home, ct_args), run(sqlite_home, ct_args))
+            if round_name == 'before writes':
+                for ct_args, stdin in actions(start, args.days):
+                    same += compare(' '.join(ct_args), run(text_home, ct_args, stdin),
+                                    run(sqlite_home, ct_args, stdin).replace(
+                                        'user0000 in %s' % os.path.join(sqlite_home, 'ct.db'),
+                                        os.path.join(text_home, 'user0000.txt')))
+        total = 2 * len(cases) + len(actions(start, args.days))
+        print '%d of %d outputs are the same' % (same, total)
+    finally:
+        shutil.rmtree(directory)
+
+    if same != total:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Seeded generator for synthetic ct logs, shared by the benchmarks."""
+
+import datetime
+import json
+import os
+import random
+
+from cuttime import util
+
+default_projects = ['billing', 'ct', 'docs', 'infra', 'meetings', 'support']
+
+default_start = datetime.datetime(2010, 1, 1)
+
+
+def project_names(count):
+    """Return *count* project names, starting with the default ones"""
+    extra = ['project%02d' % i for i in xrange(len(default_projects), count)]
+    return (default_projects + extra)[:count]
+
+
+def log_lines(days, projects=None, intervals_per_day=3, seed=0, start=default_start):
+    """Yield the lines of a log covering *days* days with up to
+    *intervals_per_day* intervals on each
+    """
+    rand = random.Random(seed)
+    projects = projects or default_projects
+    for day in xrange(days):
+        t = start + datetime.timedelta(days=day, hours=7,
+                                       seconds=rand.randint(0, 4 * 3600))
+        for _ in xrange(rand.randint(1, intervals_per_day)):
+            yield util.format_clockin(rand.choice(projects), t)
+            t += datetime.timedelta(seconds=rand.randint(10 * 60, 4 * 3600))
+            yield util.format_clockout(t)
+            t += datetime.timedelta(seconds=rand.randint(0, 3600))
+
+
+def write_log(path, days, projects=None, intervals_per_day=3, seed=0, start=default_start):
+    with open(path, 'w') as f:
+        f.writelines(log_lines(days, projects, intervals_per_day, seed, start))
+
+
+def write_home(directory, users, days, projects=None, intervals_per_day=3, seed=0,
+               start=default_start):
+    """Fill *directory* with a config and *users* logs, and return it"""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for i in xrange(users):
+        write_log(os.path.join(directory, 'user%04d.txt' % i), days, projects,
+                  intervals_per_day, seed + i, start)
+    with open(os.path.join(directory, 'config'), 'w') as f:
+        json.dump(dict(name='user0000', location='benchmark', adium=False), f)
+    return directory
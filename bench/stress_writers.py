@@ -0,0 +1,117 @@
+#!/usr/bin/python
+"""Hammer one log with clockins, clockouts and toggles from many processes at
+once, then check that the log is still consistent.
+
+Usage: python bench/stress_writers.py [--processes N] [--actions N]
+
+A consistent log has only well-formed lines, never two clockins or two
+clockouts in a row, and as many lines as the successful actions wrote.
+"""
+
+from argparse import ArgumentParser
+import datetime
+import json
+import logging
+from multiprocessing import Pool
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+import loggen
+from cuttime import build_parser, util
+
+
+class WriteCounter(logging.Handler):
+    """Count the lines ct reports having written to the log"""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.count = 0
+
+    def emit(self, record):
+        if record.getMessage().startswith('Clocked '):
+            self.count += 1
+
+
+def worker(home, seed, actions):
+    """Run *actions* random commands and return the number of lines written"""
+    os.environ['CT_HOME'] = home
+    counter = WriteCounter()
+    logging.getLogger().handlers = [counter]
+    parser = build_parser(['clockin', 'clockout', 'toggle'])
+    rand = random.Random(seed)
+    for _ in xrange(actions):
+        argv = rand.choice([['clockin', rand.choice(loggen.default_projects)],
+                            ['clockout'], ['toggle']])
+        util.now = datetime.datetime.now()
+        args = parser.parse_args(argv)
+        args.func(args)
+    return counter.count
+
+
+def check(path, expected_lines):
+    """Return a list of the problems found in the log at *path*"""
+    problems = []
+    with open(path) as f:
+        lines = f.read().splitlines()
+    if len(lines) != expected_lines:
+        problems.append('%d lines, but %d were written' % (len(lines), expected_lines))
+    last_kind = None
+    for number, line in enumerate(lines, 1):
+        if util.parse_clockin(line)[0]:
+            kind = 'clockin'
+        elif line.startswith('clockout ') and util.parse_clockout(line):
+            kind = 'clockout'
+        else:
+            problems.append('line %d is malformed: %r' % (number, line))
+            continue
+        if kind == last_kind:
+            problems.append('line %d is a second %s in a row' % (number, kind))
+        last_kind = kind
+    return problems
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=16)
+    parser.add_argument('--actions', type=int, default=200)
+    parser.add_argument('--fsync', default=False, action='store_true')
+    args = parser.parse_args()
+
+    home = tempfile.mkdtemp(prefix='ct-stress-')
+    try:
+        loggen.write_home(home, users=0, days=0)
+        os.environ['CT_HOME'] = home
+        if args.fsync:
+            conf = util.load_config()
+            with open(util.config_file_path(), 'w') as f:
+                json.dump(dict(conf, fsync=True), f)
+
+        start = time.time()
+        pool = Pool(args.processes)
+        results = [pool.apply_async(worker, (home, seed, args.actions))
+                   for seed in xrange(args.processes)]
+        written = sum(result.get() for result in results)
+        pool.close()
+        pool.join()
+        elapsed = time.time() - start
+
+        problems = check(os.path.join(home, 'user0000.txt'), written)
+        print '%d processes x %d actions: %d lines in %.2fs' % (
+            args.processes, args.actions, written, elapsed)
+        for problem in problems:
+            print problem
+        print 'FAILED' if problems else 'OK'
+        sys.exit(1 if problems else 0)
+    finally:
+        shutil.rmtree(home)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,46 +1,140 @@
 #!/usr/bin/python
 
 import argparse
+import importlib
 import logging
 import os
 import sys
+import time
 
-from cuttime.commands import commands
-from cuttime.util import load_config
+# When ct started, as far as --profile can tell
+started = time.time()
+
+from cuttime import instrument
+from cuttime.util import load_config, socket_path
 
 logging.basicConfig(level=logging.INFO, format="%(message)s")
 
 log = logging.getLogger('cuttime.main')
 
-def main():
-    home_ct = os.path.join(os.environ['HOME'], '.ct')
-    if 'CT_HOME' not in os.environ or not os.path.isdir(os.environ['CT_HOME']):
-        if not os.path.isdir(home_ct):
-            log.info('Creating ~/.ct')
-            os.mkdir(home_ct)
-        os.environ['CT_HOME'] = os.path.join(os.environ['HOME'], '.ct')
+# The module that declares each subcommand. Only the module of the subcommand
+# being run is imported, since ct is run often enough that startup time matters.
+command_modules = {
+    'clockin': 'cuttime.commands',
+    'clockout': 'cuttime.commands',
+    'toggle': 'cuttime.commands',
+    'status': 'cuttime.commands',
+    'convert': 'cuttime.commands',
+    'migrate': 'cuttime.commands',
+    'import': 'cuttime.importer',
+    'compact': 'cuttime.archive',
+    'rollup': 'cuttime.rollup',
+    'summary': 'cuttime.summary',
+    'serve': 'cuttime.daemon',
+}
+
+def load_command(name):
+    """Return the class of the subcommand *name*"""
+    importlib.import_module(command_modules[name])
+    from cuttime.commands import commands
+    return commands[name]
+
+# Options before the subcommand that take a value
+value_options = frozenset(['--profile-json', '--profile-stats'])
+
+def requested_command(argv):
+    """Return the subcommand named in *argv*, or None if there isn't a valid one"""
+    args = iter(argv)
+    for arg in args:
+        if arg in value_options:
+            next(args, None)
+        elif not arg.startswith('-'):
+            return arg if arg in command_modules else None
+    return None
+
+def add_profile_arguments(parser, default=None):
+    parser.add_argument('--profile', default=default or False, action='store_true',
+                        dest='profile', help='print where the time went when done')
+    parser.add_argument('--profile-json', default=default, metavar='FILE',
+                        dest='profile_json', help='write where the time went to FILE as JSON')
+    parser.add_argument('--profile-stats', default=default, metavar='FILE',
+                        dest='profile_stats', help='run under cProfile and write its stats to FILE')
 
+def build_parser(names):
+    """Return the argument parser for the subcommands *names*"""
     parser = argparse.ArgumentParser(prog='ct',
                                      description='Time tracking tool')
 
     subparsers = parser.add_subparsers(title='subcommands',
                                        help='Type "ct [command] --help" for more information.')
 
-    for name, cmd in commands.viewitems():
-        cmd = cmd()
+    for name in names:
+        cmd = load_command(name)()
         new_parser = subparsers.add_parser(name, description=cmd.description)
         new_parser.add_argument('--config', default=False, action='store_true',
                                 dest='config', help='update configuration options')
+        # Given before the subcommand, these must not be reset to their defaults
+        add_profile_arguments(new_parser, argparse.SUPPRESS)
         cmd.add_arguments(new_parser)
         new_parser.set_defaults(func=cmd.execute)
 
     parser.add_argument('--config', default=False, action='store_true',
                         dest='config', help='update configuration options')
+    add_profile_arguments(parser)
+    return parser
+
+def run_profiled(name, args, argv):
+    """Run the parsed command *args*, keeping track of where the time goes"""
+    instrument.enable()
+    instrument.add_time('startup', time.time() - started)
+    try:
+        with instrument.phase(name):
+            if args.profile_stats:
+                import cProfile
+                profiler = cProfile.Profile()
+                try:
+                    profiler.runcall(args.func, args)
+                finally:
+                    profiler.dump_stats(args.profile_stats)
+            else:
+                args.func(args)
+    finally:
+        if args.profile:
+            instrument.print_report(argv)
+        if args.profile_json:
+            instrument.write_json(argv, args.profile_json)
+
+def main():
+    home_ct = os.path.join(os.environ['HOME'], '.ct')
+    if 'CT_HOME' not in os.environ or not os.path.isdir(os.environ['CT_HOME']):
+        if not os.path.isdir(home_ct):
+            log.info('Creating ~/.ct')
+            os.mkdir(home_ct)
+        os.environ['CT_HOME'] = os.path.join(os.environ['HOME'], '.ct')
+
+    name = requested_command(sys.argv[1:])
+
+    # A running ct serve can answer most commands without this process having
+    # to load anything. Talking to it needs the socket module, which is slow to
+    # import, so the client is only imported when ct serve may be running.
+    if os.path.exists(socket_path()):
+        from cuttime import client
+        if client.can_serve(sys.argv[1:]):
+            status = client.run_in_daemon(sys.argv[1:])
+            if status is not None:
+                sys.exit(status)
+
+    # Without a valid subcommand, every subcommand is loaded so that help and
+    # errors can list them all
+    parser = build_parser([name] if name else sorted(command_modules))
 
     args = parser.parse_args()
     if args.config:
         load_config(reset=True)
-    args.func(args)
+    if args.profile or args.profile_json or args.profile_stats:
+        run_profiled(name, args, sys.argv[1:])
+    else:
+        args.func(args)
 
 if __name__ == '__main__':
     main()
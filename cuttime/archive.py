@@ -0,0 +1,231 @@
+"""Per-year archives of old intervals, and ``ct compact`` to create them.
+
+``ct compact`` moves closed intervals that started before a cutoff out of
+``<name>.txt`` into ``archive/<name>/<year>.txt`` in $CT_HOME. Next to each
+segment, ``<year>.totals`` holds the time spent on each project on each day, so
+summaries of archived periods don't need to parse the segments at all, and
+``spans`` holds the time span of every segment, so range queries only load the
+totals they need.
+
+``archived_intervals`` turns the totals back into stand-in intervals with the
+standins module. Only days that a --from or --to time falls in the middle of
+need the real intervals, which are then read from the segment.
+"""
+
+import bisect
+import cPickle as pickle
+import datetime
+import logging
+import os
+
+from cuttime import instrument, util
+from cuttime.cache import cached_intervals
+from cuttime.commands import Command, command
+from cuttime.standins import in_range, stand_in_intervals
+from cuttime.util import IntervalParser, format_clockin, format_clockout, log_transaction, parse_clockin, parse_date
+
+log = logging.getLogger('cuttime.archive')
+
+archive_version = 1
+
+one_day = datetime.timedelta(days=1)
+
+# Loaded totals and spans by path, with the mtime they were loaded at
+_loaded = {}
+
+
+def archive_directory(file_path):
+    directory, name = os.path.split(file_path)
+    return os.path.join(directory, 'archive', os.path.splitext(name)[0])
+
+
+def segment_paths(file_path):
+    """Return the paths of the archive segments of the log at *file_path*, oldest
+    first
+    """
+    directory = archive_directory(file_path)
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if name.endswith('.txt')]
+
+
+def totals_path(segment_path):
+    return os.path.splitext(segment_path)[0] + '.totals'
+
+
+def compute_totals(intervals):
+    """Return the totals of *intervals* in the form stored next to segments:
+    {'days': [(day, {project: timedelta})], 'odd': [(project, clockin, clockout)]},
+    where 'odd' holds the intervals that don't last any time at all
+    """
+    days = [(day, dict(project_times)) for day, project_times
+            in util.daily_project_times(i for i in intervals if i[1] < i[2])]
+    return dict(days=days, odd=[i for i in intervals if i[1] >= i[2]])
+
+
+def _write(path, data):
+    tmp_path = '%s.%d' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(dict(data, version=archive_version), f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_path, path)
+
+
+def _load(path):
+    mtime = os.stat(path).st_mtime
+    if path in _loaded and _loaded[path][0] == mtime:
+        return _loaded[path][1]
+
+    with instrument.phase('sidecars'), open(path, 'rb') as f:
+        data = pickle.load(f)
+    if data.get('version') != archive_version:
+        raise ValueError('%s has an unknown format' % path)
+    _loaded[path] = (mtime, data)
+    return data
+
+
+def load_totals(segment_path):
+    """Return the totals of a segment, as returned by compute_totals"""
+    return _load(totals_path(segment_path))
+
+
+def load_spans(file_path):
+    """Return {segment name: (first clockin, last clockout)} for the archive of
+    the log at *file_path*
+    """
+    path = os.path.join(archive_directory(file_path), 'spans')
+    return _load(path)['spans'] if os.path.exists(path) else {}
+
+
+def _segment_intervals(segment_path, from_time, to_time):
+    totals = load_totals(segment_path)
+    days = totals['days']
+
+    start, end = 0, len(days)
+    if from_time is not None:
+        start = bisect.bisect_left(days, (from_time - one_day,))
+        if to_time is not None:
+            end = bisect.bisect_left(days, (to_time,))
+
+    intervals = stand_in_intervals(
+        ((day, dict((project, t.days * 86400 + t.seconds)
+                    for project, t in project_times.iteritems()))
+         for day, project_times in days[start:end]),
+        from_time, to_time, lambda day, day_end: cached_intervals(segment_path))
+    intervals.extend(interval for interval in totals['odd']
+                     if in_range(interval, from_time, to_time))
+    return intervals
+
+
+def archived_intervals(file_path, from_time=None, to_time=None):
+    """Return (project, clockin, clockout) tuples standing in for the archived
+    intervals of the log at *file_path*, which summarize exactly like the
+    intervals themselves for {from_time...to_time}
+    """
+    spans = load_spans(file_path)
+    intervals = []
+    for segment_path in segment_paths(file_path):
+        span = spans.get(os.path.basename(segment_path))
+        if span is not None and not in_range((None,) + span, from_time, to_time):
+            # Nothing in this segment can be in the range
+            continue
+        intervals.extend(_segment_intervals(segment_path, from_time, to_time))
+    return intervals
+
+
+def split_offset(data, cutoff):
+    """Return the offset in the log text *data* up to which every interval is
+    closed and started before *cutoff*
+    """
+    parser = IntervalParser()
+    offset = split = 0
+    for line in data.splitlines(True):
+        if 'clockin' in line:
+            if parse_clockin(line)[1] >= cutoff:
+                break
+            if parser.pending is None:
+                split = offset
+        parser.feed(line)
+        offset += len(line)
+    else:
+        if parser.pending is None:
+            split = offset
+    return split
+
+
+def compact(file_path, cutoff):
+    """Move the closed intervals of the log at *file_path* that started before
+    *cutoff* into its archive, and return how many were moved
+    """
+    with log_transaction(file_path):
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        split = split_offset(data, cutoff)
+        parser = IntervalParser()
+        for line in data[:split].splitlines():
+            parser.feed(line)
+        if not parser.intervals:
+            return 0
+
+        years = {}
+        for interval in parser.intervals:
+            years.setdefault(interval[1].year, []).append(interval)
+
+        directory = archive_directory(file_path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        spans = dict(load_spans(file_path))
+        for year, intervals in sorted(years.iteritems()):
+            segment_path = os.path.join(directory, '%d.txt' % year)
+            with open(segment_path, 'ab') as f:
+                f.write(''.join(format_clockin(project, clockin_time) +
+                                format_clockout(clockout_time)
+                                for project, clockin_time, clockout_time in intervals))
+                f.flush()
+                os.fsync(f.fileno())
+            segment_intervals = util.file_intervals(segment_path)
+            _write(totals_path(segment_path), compute_totals(segment_intervals))
+            spans[os.path.basename(segment_path)] = (
+                min(clockin_time for _, clockin_time, _ in segment_intervals),
+                max(clockout_time for _, _, clockout_time in segment_intervals))
+        _write(os.path.join(directory, 'spans'), dict(spans=spans))
+
+        tmp_path = '%s.%d' % (file_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(data[split:])
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, file_path)
+    return len(parser.intervals)
+
+
+@command('compact')
+class CompactCommand(Command):
+
+    description = 'Move old intervals out of your log into yearly archives'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', dest='before', default=None,
+                            help='archive intervals that started before this date '
+                                 '(default: the start of this year)')
+        parser.add_argument('--all', dest='all', default=False, action='store_true',
+                            help="compact every user's log, not just yours")
+
+    def execute(self, args):
+        if args.before:
+            cutoff = parse_date(args.before)
+        else:
+            cutoff = datetime.datetime(util.now.year, 1, 1)
+
+        if args.all:
+            file_paths = sorted(path for path in util.all_files() if path.endswith('.txt'))
+        else:
+            file_paths = [util.path_for_current_user()]
+
+        for file_path in file_paths:
+            if not os.path.exists(file_path):
+                log.error('%s does not exist.' % file_path)
+                continue
+            count = compact(file_path, cutoff)
+            log.info('Archived %d intervals from %s into %s' % (
+                count, file_path, archive_directory(file_path)))
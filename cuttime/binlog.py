@@ -0,0 +1,260 @@
+"""Compact binary logs.
+
+A binary log holds the same intervals as a text log, but in fixed-size records
+that can be memory-mapped and searched by time without parsing every entry:
+
+    header    magic, record count, project count, longest closed interval in
+              seconds, index of the open record (-1 if there is none)
+    records   (project id, clockin epoch, clockout epoch), sorted by clockin
+    projects  project names separated by newlines, in project id order
+
+Epochs count seconds since 1970-01-01 in the same local time the text log uses,
+so converting back and forth is lossless. An interval that hasn't been clocked
+out of yet has a clockout epoch of -1.
+
+A binary log can be a user's live log: clockouts fill in the open record in
+place, and clockins copy the records as they are and add one to the end.
+"""
+
+import datetime
+import mmap
+import os
+import struct
+
+from cuttime import instrument, util
+
+binary_extension = '.ctb'
+
+magic = 'CTB1'
+header_format = struct.Struct('<4sIIqi')
+record_format = struct.Struct('<Iqq')
+open_epoch = -1
+
+_epoch = datetime.datetime(1970, 1, 1)
+
+
+def to_epoch(time):
+    delta = time - _epoch
+    return delta.days * 86400 + delta.seconds
+
+
+def from_epoch(seconds):
+    return _epoch + datetime.timedelta(seconds=seconds)
+
+
+def is_binary_log(path):
+    return path.endswith(binary_extension)
+
+
+class BinaryLog(object):
+    """Read-only view of a binary log"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (file_magic, self.record_count, project_count,
+         self.max_duration, self.open_record) = header_format.unpack_from(self.map)
+        if file_magic != magic:
+            self.map.close()
+            raise ValueError('%s is not a binary ct log' % path)
+        self.table_start = header_format.size + self.record_count * record_format.size
+        self.projects = self.map[self.table_start:].split('\n') if project_count else []
+
+    def close(self):
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record(self, i):
+        """Return (project, clockin epoch, clockout epoch) for record *i*"""
+        project_id, start, end = record_format.unpack_from(
+            self.map, header_format.size + i * record_format.size)
+        return self.projects[project_id], start, end
+
+    def _bisect(self, epoch):
+        """Return the index of the first record starting at or after *epoch*"""
+        lo, hi = 0, self.record_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.record(mid)[1] < epoch:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def records(self, from_time=None, to_time=None):
+        """Yield (project, clockin epoch, clockout epoch) for each record that
+        overlaps {from_time...to_time}
+        """
+        lo, hi = 0, self.record_count
+        if from_time is not None:
+            # Nothing closed can end after from_time if it started more than the
+            # longest interval before it
+            lo = self._bisect(to_epoch(from_time) - self.max_duration)
+        if to_time is not None:
+            hi = self._bisect(to_epoch(to_time))
+        from_seconds = to_epoch(from_time) if from_time is not None else None
+
+        # The open record runs until now, so it can overlap the range from any
+        # distance back
+        if 0 <= self.open_record < lo:
+            yield self.record(self.open_record)
+        for i in xrange(lo, hi):
+            project, start, end = self.record(i)
+            if end == open_epoch or from_seconds is None or end > from_seconds:
+                yield project, start, end
+
+
+def read_intervals(path, from_time=None, to_time=None):
+    """Return a list of (project, clockin, clockout) tuples for the intervals in
+    the binary log at *path* that overlap {from_time...to_time}. An interval that
+    has not been clocked out of yet ends at *now*.
+    """
+    with instrument.phase('read'), BinaryLog(path) as binary_log:
+        intervals = [(project, from_epoch(start),
+                      util.now if end == open_epoch else from_epoch(end))
+                     for project, start, end in binary_log.records(from_time, to_time)]
+    instrument.count('bytes read', len(intervals) * record_format.size)
+    return intervals
+
+
+def write_binary_log(path, intervals, pending=None):
+    """Write (project, clockin, clockout) *intervals* and an optional open
+    (project, clockin) *pending* interval to a binary log at *path*
+    """
+    project_ids = {}
+    records = []
+    max_duration = 0
+    for project, clockin_time, clockout_time in intervals:
+        start, end = to_epoch(clockin_time), to_epoch(clockout_time)
+        max_duration = max(max_duration, end - start)
+        records.append((start, project_ids.setdefault(project, len(project_ids)), end))
+    if pending:
+        project, clockin_time = pending
+        records.append((to_epoch(clockin_time),
+                        project_ids.setdefault(project, len(project_ids)), open_epoch))
+    records.sort(key=lambda record: record[0])
+
+    open_record = -1
+    for i, (start, project_id, end) in enumerate(records):
+        if end == open_epoch:
+            open_record = i
+
+    _replace(path, header_format.pack(magic, len(records), len(project_ids),
+                                      max_duration, open_record) +
+             ''.join(record_format.pack(project_id, start, end)
+                     for start, project_id, end in records) +
+             '\n'.join(sorted(project_ids, key=project_ids.get)))
+
+
+def _replace(path, data):
+    """Write *data* to *path* all at once, so that readers see either the old
+    log or the new one
+    """
+    tmp_path = '%s.%d' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_path, path)
+
+
+def write_clockin(path, project, time):
+    """Start an interval on *project* at *time* in the binary log at *path*,
+    which is created if it doesn't exist. Like a clockin line in a text log, this
+    ends the open interval, if there is one, at *time*.
+    """
+    start = to_epoch(time)
+    if not os.path.exists(path):
+        write_binary_log(path, [], (project, time))
+        return
+    with BinaryLog(path) as binary_log:
+        last_start = (binary_log.record(binary_log.record_count - 1)[1]
+                      if binary_log.record_count else None)
+        if last_start is not None and start < last_start:
+            # Backdated, so the records have to be sorted again
+            intervals, pending = read_all(binary_log)
+            if pending:
+                intervals.append(pending + (time,))
+            write_binary_log(path, intervals, (project, time))
+            return
+        records = binary_log.map[header_format.size:binary_log.table_start]
+        projects = list(binary_log.projects)
+        max_duration = binary_log.max_duration
+        if binary_log.open_record >= 0:
+            project_id, open_start, _ = record_format.unpack_from(
+                binary_log.map, header_format.size + binary_log.open_record * record_format.size)
+            offset = binary_log.open_record * record_format.size
+            records = (records[:offset] + record_format.pack(project_id, open_start, start) +
+                       records[offset + record_format.size:])
+            max_duration = max(max_duration, start - open_start)
+        count = binary_log.record_count
+
+    if project not in projects:
+        projects.append(project)
+    _replace(path, header_format.pack(magic, count + 1, len(projects), max_duration, count) +
+             records + record_format.pack(projects.index(project), start, open_epoch) +
+             '\n'.join(projects))
+
+
+def write_clockout(path, time):
+    """End the open interval of the binary log at *path* at *time*, in place"""
+    with open(path, 'r+b') as f:
+        header = f.read(header_format.size)
+        file_magic, count, project_count, max_duration, open_record = header_format.unpack(header)
+        if open_record < 0:
+            return
+        offset = header_format.size + open_record * record_format.size
+        f.seek(offset)
+        project_id, start, _ = record_format.unpack(f.read(record_format.size))
+        end = to_epoch(time)
+        f.seek(offset)
+        f.write(record_format.pack(project_id, start, end))
+        f.seek(0)
+        f.write(header_format.pack(file_magic, count, project_count,
+                                   max(max_duration, end - start), -1))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_all(binary_log):
+    """Return (intervals, pending) for everything in *binary_log*: every closed
+    (project, clockin, clockout) interval, and the (project, clockin) of the open
+    one, or None
+    """
+    intervals, pending = [], None
+    for i in xrange(binary_log.record_count):
+        project, start, end = binary_log.record(i)
+        if end == open_epoch:
+            pending = project, from_epoch(start)
+        else:
+            intervals.append((project, from_epoch(start), from_epoch(end)))
+    return intervals, pending
+
+
+def text_to_binary(source, dest):
+    parser = util.IntervalParser()
+    with open(source, 'r') as f:
+        for line in f:
+            parser.feed(line)
+    write_binary_log(dest, parser.intervals, parser.pending)
+
+
+def binary_to_text(source, dest):
+    pending = None
+    with BinaryLog(source) as binary_log:
+        with open(dest, 'w') as f:
+            for i in xrange(binary_log.record_count):
+                project, start, end = binary_log.record(i)
+                if end == open_epoch:
+                    pending = project, start
+                    continue
+                f.write(util.format_clockin(project, from_epoch(start)))
+                f.write(util.format_clockout(from_epoch(end)))
+            # A clockin with no clockout has to be the last line of a text log
+            if pending:
+                f.write(util.format_clockin(pending[0], from_epoch(pending[1])))
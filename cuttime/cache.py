@@ -0,0 +1,152 @@
+"""Parsed intervals for each log, kept in a sidecar file next to it in $CT_HOME.
+
+Logs are only ever appended to, so the cache remembers how far into the log it
+has parsed and which file it was. When the log has grown, only the new lines are
+parsed. When it has been replaced or rewritten, the cache is rebuilt.
+"""
+
+import cPickle as pickle
+import logging
+import os
+
+from cuttime import instrument
+from cuttime.util import IntervalParser
+
+log = logging.getLogger('cuttime.cache')
+
+cache_version = 1
+
+# Number of bytes before the parsed offset used to check that the log still
+# starts with what was parsed last time
+check_size = 64
+
+# Sidecars this process has already loaded or updated. A long-running process
+# (ct serve) then only has to read what was appended since its last request.
+_loaded = {}
+
+
+def sidecar_path(file_path, kind):
+    directory, name = os.path.split(file_path)
+    return os.path.join(directory, '.%s.%s' % (os.path.splitext(name)[0], kind))
+
+
+def cache_path(file_path):
+    return sidecar_path(file_path, 'cache')
+
+
+def load_state(path, version):
+    """Return the state pickled at *path*, or None if it is missing, unreadable
+    or of another version
+    """
+    try:
+        with instrument.phase('sidecars'):
+            with open(path, 'rb') as f:
+                state = pickle.load(f)
+    except Exception:
+        # Missing, unreadable or corrupt sidecars are simply rebuilt
+        return None
+    if not isinstance(state, dict) or state.get('version') != version:
+        return None
+    return state
+
+
+def save_state(path, state):
+    """Pickle *state* to *path*, replacing it all at once"""
+    tmp_path = '%s.%d' % (path, os.getpid())
+    try:
+        with instrument.phase('sidecars'):
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, path)
+    except (IOError, OSError), e:
+        log.debug("Couldn't write %s: %s" % (path, e))
+
+
+def _is_same_file(f, stat, state):
+    """Return True if *f* is the file *state* was parsed from, possibly with more
+    lines appended to it
+    """
+    if (stat.st_dev, stat.st_ino) != (state['device'], state['inode']):
+        return False
+    if stat.st_size < state['size']:
+        return False
+    f.seek(state['offset'] - len(state['check']))
+    return f.read(len(state['check'])) == state['check']
+
+
+def update_sidecar(file_path, kind, version, empty_state, consume):
+    """Bring the *kind* sidecar of *file_path* up to date and return (state,
+    partial), where *partial* is an unterminated last line of the log.
+
+    If the log was replaced or rewritten, parsing starts over from
+    ``empty_state()``. Complete lines appended since the last update are passed
+    to ``consume(state, data, offset)``, where *offset* is the position of *data*
+    in the log, and *consume* folds them into *state*.
+    """
+    path = sidecar_path(file_path, kind)
+    state = _loaded.get(path) or load_state(path, version)
+    with open(file_path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        if state is None or not _is_same_file(f, stat, state):
+            state = empty_state()
+            state.update(version=version, device=None, inode=None, size=0,
+                         mtime=None, offset=0, check='')
+        elif (stat.st_size, stat.st_mtime) == (state['offset'], state['mtime']):
+            _loaded[path] = state
+            return state, ''
+        with instrument.phase('read'):
+            f.seek(state['offset'])
+            data = f.read()
+    instrument.count('bytes read', len(data))
+
+    end = data.rfind('\n') + 1
+    if end:
+        instrument.count('lines parsed', data.count('\n', 0, end))
+        with instrument.phase('parse'):
+            consume(state, data[:end], state['offset'])
+        state['check'] = (state['check'] + data[:end])[-check_size:]
+    state.update(device=stat.st_dev, inode=stat.st_ino, size=stat.st_size,
+                 mtime=stat.st_mtime, offset=state['offset'] + end)
+    save_state(path, state)
+    _loaded[path] = state
+    return state, data[end:]
+
+
+def forget_sidecar(file_path, kind):
+    """Forget what this process loaded of the *kind* sidecar of *file_path*, so
+    that the next update reads it again
+    """
+    _loaded.pop(sidecar_path(file_path, kind), None)
+
+
+def remove_sidecar(file_path, kind):
+    """Forget the *kind* sidecar of *file_path*, so that the next update rebuilds
+    it from the whole log
+    """
+    forget_sidecar(file_path, kind)
+    path = sidecar_path(file_path, kind)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _consume(state, data, offset):
+    parser = IntervalParser(state['intervals'], state['pending'])
+    for line in data.splitlines():
+        parser.feed(line)
+    state['pending'] = parser.pending
+
+
+def _parser(file_path):
+    state, partial = update_sidecar(file_path, 'cache', cache_version,
+                                    lambda: dict(intervals=[], pending=None),
+                                    _consume)
+    parser = IntervalParser(state['intervals'], state['pending'])
+    if partial:
+        parser = parser.copy()
+        parser.feed(partial)
+    return parser
+
+
+def cached_intervals(file_path):
+    """Return a list of (project, clockin, clockout) tuples for *file_path*"""
+    return _parser(file_path).all_intervals()
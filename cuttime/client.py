@@ -0,0 +1,68 @@
+"""Talking to a running ``ct serve``.
+
+Requests and replies are single lines of JSON. A request holds the arguments ct
+was run with, and the reply holds what the command wrote to stdout and stderr
+and its exit status.
+"""
+
+import json
+import logging
+import socket
+import sys
+
+from cuttime.util import socket_path
+
+log = logging.getLogger('cuttime.client')
+
+# Subcommands that ct serve runs. The others are rare enough not to matter, or
+# need to run in the user's own process.
+served_commands = frozenset(['clockin', 'clockout', 'toggle', 'status', 'summary'])
+
+# Arguments that print help, prompt for input, profile ct or keep it running,
+# which only work in ct itself
+local_arguments = frozenset(['-h', '--help', '--config', '--profile', '--profile-json',
+                             '--profile-stats', '--follow'])
+
+
+def can_serve(argv):
+    """Return True if ct serve can run ct *argv*, if it is running"""
+    commands = [arg for arg in argv if not arg.startswith('-')]
+    return (bool(commands) and commands[0] in served_commands
+            and not local_arguments.intersection(arg.split('=', 1)[0] for arg in argv))
+
+
+def connect():
+    """Return a socket connected to ct serve, or None if it isn't running"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path())
+    except socket.error:
+        sock.close()
+        return None
+    return sock
+
+
+def run_in_daemon(argv):
+    """Run ct *argv* in ct serve, and return its exit status, or None if ct
+    serve isn't running
+    """
+    sock = connect()
+    if sock is None:
+        return None
+    try:
+        f = sock.makefile('r+b')
+        f.write(json.dumps(dict(argv=argv)) + '\n')
+        f.flush()
+        line = f.readline()
+    finally:
+        sock.close()
+
+    if not line:
+        # The command may or may not have run, so running it again here could
+        # log it twice
+        log.error('ct serve stopped before answering.')
+        return 1
+    reply = json.loads(line)
+    sys.stdout.write(reply['stdout'].encode('utf-8'))
+    sys.stderr.write(reply['stderr'].encode('utf-8'))
+    return reply['status']
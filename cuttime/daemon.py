@@ -0,0 +1,90 @@
+"""``ct serve``: keep config and parsed logs in memory and run ct commands sent
+over a Unix domain socket in $CT_HOME.
+
+Commands run one at a time in the server process, exactly as they would in ct
+itself, so they share the config memoized by ``util.load_config`` and the
+sidecars memoized by ``cache.update_sidecar``. Both are checked against the
+files on every request, so changes made without the daemon are picked up.
+"""
+
+from cStringIO import StringIO
+import datetime
+import json
+import logging
+import os
+import sys
+import traceback
+
+from cuttime import client, util
+from cuttime.commands import Command, command
+
+log = logging.getLogger('cuttime.daemon')
+
+
+def run_command(parser, argv):
+    """Run ct *argv* and return a dict of its output and exit status"""
+    util.now = datetime.datetime.now()
+    out, err = StringIO(), StringIO()
+    handler = logging.StreamHandler(err)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    root = logging.getLogger()
+    handlers, root.handlers = root.handlers, [handler]
+    sys.stdout, sys.stderr = out, err
+    status = 0
+    try:
+        args = parser.parse_args(argv)
+        args.func(args)
+    except SystemExit, e:
+        # Raised by argparse for bad arguments
+        status = e.code if isinstance(e.code, int) else 1
+    except Exception:
+        traceback.print_exc()
+        status = 1
+    finally:
+        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+        root.handlers = handlers
+    return dict(stdout=out.getvalue(), stderr=err.getvalue(), status=status)
+
+
+@command('serve')
+class ServeCommand(Command):
+
+    description = 'Keep logs parsed in memory and run other ct commands quickly'
+
+    def add_arguments(self, parser):
+        pass
+
+    def execute(self, args):
+        from SocketServer import StreamRequestHandler, UnixStreamServer
+        from cuttime import build_parser
+
+        path = util.socket_path()
+        if client.connect() is not None:
+            log.error('ct serve is already running on %s.' % path)
+            return
+        if os.path.exists(path):
+            # Left behind by a ct serve that didn't exit cleanly
+            os.remove(path)
+
+        util.load_config()
+        parser = build_parser(sorted(client.served_commands))
+
+        class Handler(StreamRequestHandler):
+
+            def handle(self):
+                line = self.rfile.readline()
+                if not line:
+                    return
+                argv = [arg.encode('utf-8') for arg in json.loads(line)['argv']]
+                reply = run_command(parser, argv)
+                self.wfile.write(json.dumps(reply) + '\n')
+
+        server = UnixStreamServer(path, Handler)
+        log.info('Serving %s on %s' % (util.working_directory(), path))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.remove(path)
@@ -0,0 +1,148 @@
+"""``ct import``: add many past intervals to your log at once.
+
+Intervals are read from CSV (project,clockin,clockout, with an optional header
+row) or JSON lines ({"project": ..., "clockin": ..., "clockout": ...}). All of
+them are checked before anything is written, and they are merged into the log
+in clockin order, in a single write to a text log.
+"""
+
+import csv
+import datetime
+import json
+import logging
+import sys
+
+from cuttime import storage
+from cuttime.commands import Command, command
+from cuttime.util import parse_date
+
+log = logging.getLogger('cuttime.importer')
+
+# Errors reported before giving up on listing them all
+max_errors = 20
+
+
+def read_csv(f):
+    """Yield (line number, project, clockin string, clockout string) for each
+    row of a CSV file
+    """
+    for number, row in enumerate(csv.reader(f), 1):
+        if not row or (number == 1 and row[0].strip().lower() == 'project'):
+            continue
+        if len(row) != 3:
+            raise ValueError('line %d: expected project,clockin,clockout' % number)
+        yield number, row[0], row[1], row[2]
+
+
+def read_jsonl(f):
+    """Yield (line number, project, clockin string, clockout string) for each
+    object in a JSON lines file
+    """
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            times = record['clockin'], record['clockout']
+            if not all(isinstance(time, basestring) for time in times):
+                raise TypeError('clockin and clockout must be strings')
+            yield (number, record['project'].encode('utf-8')) + times
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise ValueError('line %d: expected an object with project, clockin '
+                             'and clockout' % number)
+
+readers = dict(csv=read_csv, jsonl=read_jsonl)
+
+
+def parse_rows(rows, errors):
+    """Return the (project, clockin, clockout) tuples in *rows*, adding a message
+    to *errors* for each one that is invalid by itself
+    """
+    intervals = []
+    for number, project, clockin, clockout in rows:
+        project = project.strip()
+        if not project or '\n' in project or ' clockin ' in ' %s ' % project:
+            errors.append('line %d: invalid project name %r' % (number, project))
+            continue
+        try:
+            clockin_time = parse_date(clockin.strip())
+            clockout_time = parse_date(clockout.strip())
+        except (ValueError, OverflowError), e:
+            errors.append('line %d: %s' % (number, e))
+            continue
+        if clockout_time <= clockin_time:
+            errors.append('line %d: clockout is not after clockin' % number)
+            continue
+        intervals.append((project, clockin_time, clockout_time))
+    return intervals
+
+
+def find_overlaps(existing, imported, errors):
+    """Add a message to *errors* for each imported interval that overlaps another
+    imported interval or one of *existing*. Overlaps between existing intervals
+    are left alone.
+    """
+    tagged = sorted([(start, end, project, False) for project, start, end in existing] +
+                    [(start, end, project, True) for project, start, end in imported])
+    latest = None
+    for interval in tagged:
+        start, end, project, is_new = interval
+        if latest is not None and start < latest[1] and (is_new or latest[3]):
+            errors.append('%s from %s to %s overlaps %s from %s to %s' % (
+                project, start, end, latest[2], latest[0], latest[1]))
+        if latest is None or end > latest[1]:
+            latest = interval
+
+
+@command('import')
+class ImportCommand(Command):
+
+    description = 'Add intervals read from CSV or JSON lines to your log'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', type=str, action='store', default='-', nargs='?',
+                            help='file to read (default: stdin)')
+        parser.add_argument('--format', dest='format', default='csv',
+                            choices=sorted(readers),
+                            help='csv (project,clockin,clockout) or jsonl')
+        parser.add_argument('-n', '--dry-run', dest='dry_run', default=False,
+                            action='store_true', help='check the intervals without importing them')
+
+    def execute(self, args):
+        f = sys.stdin if args.source == '-' else open(args.source, 'rb')
+        errors = []
+        try:
+            intervals = parse_rows(readers[args.format](f), errors)
+        except ValueError, e:
+            log.error(str(e))
+            return
+        finally:
+            if f is not sys.stdin:
+                f.close()
+        if not intervals and not errors:
+            log.info('Nothing to import.')
+            return
+        intervals.sort(key=lambda interval: interval[1])
+
+        store = storage.storage()
+        with store.transaction():
+            existing, pending = store.entries(store.current())
+            if pending:
+                # Nothing can be imported after a clockin that is still open
+                existing.append(pending + (datetime.datetime.max,))
+            find_overlaps(existing, intervals, errors)
+
+            if errors:
+                for error in errors[:max_errors]:
+                    log.error(error)
+                if len(errors) > max_errors:
+                    log.error('... and %d more errors' % (len(errors) - max_errors))
+                log.error('Nothing was imported.')
+                return
+            if args.dry_run:
+                log.info('%d intervals can be imported.' % len(intervals))
+                return
+
+            store.add_intervals(intervals)
+        log.info('Imported %d intervals into %s' % (len(intervals),
+                                                    store.describe(store.current())))
@@ -0,0 +1,86 @@
+"""Sparse time index for text logs.
+
+For each month, the index remembers the byte offset of the first clockin in
+that month, along with the longest closed interval in the log. A query for
+{from_time...to_time} seeks to the month in which the first overlapping
+interval can start and stops reading at the first clockin after to_time, so it
+only parses the part of the log it needs.
+
+This only works if clockins appear in the log in time order, which is the case
+unless entries were backdated with --time. For other logs range_intervals
+returns None and the whole log has to be read.
+"""
+
+import datetime
+
+from cuttime import instrument
+from cuttime.cache import update_sidecar
+from cuttime.util import IntervalParser, parse_clockin, parse_clockout
+
+index_version = 1
+
+
+def _empty_state():
+    return dict(months=[], ordered=True, last_clockin=None, pending=None,
+                max_duration=datetime.timedelta(0))
+
+
+def _consume(state, data, offset):
+    for line in data.splitlines(True):
+        if 'clockin' in line:
+            _, clockin_time = parse_clockin(line)
+            if state['pending'] is not None:
+                state['max_duration'] = max(state['max_duration'],
+                                            clockin_time - state['pending'])
+            if state['last_clockin'] is not None and clockin_time < state['last_clockin']:
+                state['ordered'] = False
+            month = datetime.datetime(year=clockin_time.year, month=clockin_time.month, day=1)
+            if not state['months'] or month > state['months'][-1][0]:
+                state['months'].append((month, offset))
+            state['last_clockin'] = state['pending'] = clockin_time
+        elif line.startswith('clockout ') and state['pending'] is not None:
+            state['max_duration'] = max(state['max_duration'],
+                                        parse_clockout(line) - state['pending'])
+            state['pending'] = None
+        offset += len(line)
+
+
+def range_intervals(file_path, from_time, to_time, closed_only=False):
+    """Return a list of (project, clockin, clockout) tuples for the intervals in
+    *file_path* that overlap {from_time...to_time}, or None if the log can't be
+    searched by time. Unless *closed_only* is set, an interval that hasn't been
+    clocked out of yet ends at now.
+    """
+    state, _ = update_sidecar(file_path, 'index', index_version, _empty_state, _consume)
+    if not state['ordered']:
+        return None
+
+    offset = 0
+    if from_time is not None:
+        earliest = from_time - state['max_duration']
+        for month, month_offset in state['months']:
+            if month > earliest:
+                break
+            offset = month_offset
+
+    parser = IntervalParser()
+    lines = size = 0
+    with instrument.phase('parse'), open(file_path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            lines += 1
+            size += len(line)
+            if to_time is not None and 'clockin' in line:
+                clockin_time = parse_clockin(line)[1]
+                if clockin_time >= to_time:
+                    # This clockin still ends the interval before it
+                    if parser.pending:
+                        parser.intervals.append(parser.pending + (clockin_time,))
+                        parser.pending = None
+                    break
+            parser.feed(line)
+    instrument.count('lines parsed', lines)
+    instrument.count('bytes read', size)
+    intervals = parser.intervals if closed_only else parser.all_intervals()
+    return [interval for interval in intervals
+            if from_time is None or interval[2] > from_time]
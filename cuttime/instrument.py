@@ -0,0 +1,99 @@
+"""Timing and counting what a ct command spends its time on, for --profile.
+
+Code is divided into phases with ``with phase(name):``, and counters are added
+to with ``count(name, n)``. Phases can be nested, and each phase's time leaves
+out the time spent in the phases inside it, so the times of all phases add up
+to the time the command took. Until ``enable()`` is called, none of this does
+anything, so it is only used around whole files or reads, never single lines.
+"""
+
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+import json
+import sys
+import time
+
+enabled = False
+
+# Seconds spent in each phase, in the order the phases were first entered
+phases = OrderedDict()
+
+counters = defaultdict(int)
+
+# Time spent in nested phases, for each phase that is running
+_nested = []
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def add_time(name, seconds):
+    phases[name] = phases.get(name, 0.0) + seconds
+
+
+@contextmanager
+def phase(name):
+    """Count the time spent in the block as phase *name*"""
+    if not enabled:
+        yield
+        return
+    start = time.time()
+    _nested.append(0.0)
+    try:
+        yield
+    finally:
+        elapsed = time.time() - start
+        add_time(name, elapsed - _nested.pop())
+        if _nested:
+            _nested[-1] += elapsed
+
+
+def timed(name, iterable):
+    """Return *iterable*, counting the time spent producing each item as phase
+    *name*
+    """
+    if not enabled:
+        return iterable
+    return _timed(name, iter(iterable))
+
+
+def _timed(name, iterator):
+    while True:
+        with phase(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def count(name, n=1):
+    if enabled:
+        counters[name] += n
+
+
+def report(argv):
+    """Return the phases and counters as a dict"""
+    return dict(argv=argv,
+                phases=[dict(name=name, seconds=seconds) for name, seconds in phases.iteritems()],
+                total=sum(phases.values()),
+                counters=dict(counters))
+
+
+def print_report(argv, f=None):
+    """Write the phases and counters to *f* (by default stderr) as a table"""
+    f = f or sys.stderr
+    data = report(argv)
+    f.write('Profile of ct %s\n' % ' '.join(argv))
+    for entry in data['phases']:
+        f.write('  %-14s %9.1fms\n' % (entry['name'], entry['seconds'] * 1000))
+    f.write('  %-14s %9.1fms\n' % ('total', data['total'] * 1000))
+    for name, value in sorted(data['counters'].iteritems()):
+        f.write('  %-14s %9d\n' % (name, value))
+
+
+def write_json(argv, path):
+    with open(path, 'w') as f:
+        json.dump(report(argv), f, indent=2, sort_keys=True)
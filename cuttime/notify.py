@@ -0,0 +1,170 @@
+"""Telling other programs what you are working on after a clockin or clockout.
+
+Notifications are sent from a detached child process, so ct returns as soon as
+the log has been written no matter how slow the sinks are. Each sink is a
+function that takes an event dict and the options it was configured with.
+Sinks are declared with ``@sink(name)`` and enabled by listing them in the
+config, e.g.::
+
+    "notify": [{"type": "file", "path": "~/.ct-status"},
+               {"type": "command", "argv": ["notify-send", "ct", "%(message)s"]},
+               {"type": "webhook", "url": "http://localhost:8000/ct"}]
+
+Setting "adium" in the config enables the adium sink.
+"""
+
+import json
+import logging
+import os
+import signal
+import time
+
+from cuttime.util import load_config, working_directory
+
+log = logging.getLogger('cuttime.notify')
+
+# Seconds the notifying process may run before it is killed
+timeout = 10
+
+adium_blurb = '\n\nThis message brought to you by ct (github.com/irskep/ct)'
+
+# Seconds to trust a check of whether an application is running
+app_check_ttl = 300
+
+sinks = {}
+
+def sink(name):
+    """Declare a sink"""
+    def dec(func):
+        sinks[name] = func
+        return func
+    return dec
+
+
+def configured_sinks():
+    """Return a list of the options of every sink enabled in the config"""
+    conf = load_config()
+    options = list(conf.get('notify', []))
+    if conf['adium']:
+        options.append(dict(type='adium'))
+    return options
+
+
+def notify(event):
+    """Send *event* to every configured sink from a detached process, without
+    waiting for it
+    """
+    options = configured_sinks()
+    if not options:
+        return
+
+    pid = os.fork()
+    if pid:
+        # The intermediate child exits right away, so the notifying process is
+        # never left as a zombie of a long-running ct serve
+        os.waitpid(pid, 0)
+        return
+
+    try:
+        os.setsid()
+        if os.fork():
+            os._exit(0)
+        _detach()
+        signal.alarm(timeout)
+        send(event, options)
+    finally:
+        os._exit(0)
+
+
+def _detach():
+    """Stop sharing files with ct, so that ct's output ends when ct exits and
+    any lock it holds on the log is released, and log to $CT_HOME/notify.log
+    instead
+    """
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+    os.closerange(3, os.sysconf('SC_OPEN_MAX'))
+
+    handler = logging.FileHandler(os.path.join(working_directory(), 'notify.log'))
+    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    logging.getLogger().handlers = [handler]
+
+
+def send(event, options):
+    """Send *event* to the sinks described by *options*, one at a time"""
+    for sink_options in options:
+        func = sinks.get(sink_options.get('type'))
+        if func is None:
+            log.error('Unknown notification sink %r' % sink_options.get('type'))
+            continue
+        try:
+            func(event, sink_options)
+        except Exception, e:
+            log.error('%s notification failed: %s' % (sink_options['type'], e))
+
+
+### Sinks ###
+
+@sink('file')
+def notify_file(event, options):
+    """Replace the file at options['path'] with the event's message"""
+    path = os.path.expanduser(options['path'])
+    tmp_path = '%s.%d' % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        f.write(event['message'].encode('utf-8') + '\n')
+    os.rename(tmp_path, path)
+
+
+@sink('command')
+def notify_command(event, options):
+    """Run options['argv'], with the event's fields substituted for
+    %(name)s in each argument
+    """
+    from subprocess import Popen
+    argv = [(arg % event).encode('utf-8') for arg in options['argv']]
+    Popen(argv).wait()
+
+
+@sink('webhook')
+def notify_webhook(event, options):
+    """POST the event as JSON to options['url']"""
+    import urllib2
+    request = urllib2.Request(options['url'], json.dumps(event),
+                              {'Content-Type': 'application/json'})
+    urllib2.urlopen(request, timeout=options.get('timeout', timeout)).close()
+
+
+@sink('adium')
+def notify_adium(event, options):
+    if not app_running('Adium'):
+        return
+    from subprocess import Popen
+    away_str = 'away' if event['away'] else 'available'
+    status = event['message'] + adium_blurb
+    script = 'tell app "Adium" to go %s with message "%s"' % (away_str, status)
+    Popen(['osascript', '-e', script.encode('utf-8')]).wait()
+
+
+def app_running(name):
+    """Return True if an application called *name* is running. The answer is
+    remembered in $CT_HOME/.apps for app_check_ttl seconds.
+    """
+    path = os.path.join(working_directory(), '.apps')
+    try:
+        with open(path) as f:
+            checks = json.load(f)
+    except (IOError, ValueError):
+        checks = {}
+
+    checked_at, running = checks.get(name, (0, False))
+    if time.time() - checked_at < app_check_ttl:
+        return running
+
+    from subprocess import Popen, PIPE
+    output = Popen(['ps', '-A', '-o', 'comm='], stdout=PIPE).communicate()[0]
+    running = name in [os.path.basename(line.strip()) for line in output.splitlines()]
+    checks[name] = (time.time(), running)
+    with open(path, 'w') as f:
+        json.dump(checks, f)
+    return running
@@ -0,0 +1,97 @@
+"""Periods that summaries can add up days into: days, weeks, calendar months and
+billing cycles of any number of days.
+
+The period a day falls in is worked out with a little arithmetic on its ordinal
+(or year and month), so no calendars are built, however many years a report
+covers. Weeks start on a configurable weekday, and N-day cycles count from a
+given first day, by default one that a week starts on, so that cycles of whole
+weeks line up with weeks.
+"""
+
+from collections import defaultdict
+import datetime
+import re
+
+weekdays = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+units = ('day', 'week', 'month')
+
+cycle_re = re.compile(r'^(\d+)d(ays?)?$')
+
+
+def weekday_index(name):
+    """Return the index (Monday is 0) of the weekday *name*, which may be
+    abbreviated, or raise ValueError
+    """
+    matches = [i for i, weekday in enumerate(weekdays)
+               if len(name) >= 2 and weekday.startswith(name.lower())]
+    if len(matches) != 1:
+        raise ValueError('%r is not a day of the week' % name)
+    return matches[0]
+
+
+def _midnight(day):
+    return datetime.datetime(day.year, day.month, day.day)
+
+
+class Period(object):
+    """One kind of period: 'day', 'week' (starting on *week_start*, Monday being
+    0) or 'month', or a cycle of *days* days, one of which starts on *start*
+    """
+
+    def __init__(self, unit, week_start=6, days=None, start=None):
+        self.unit = unit
+        self.week_start = week_start
+        self.days = days
+        if unit == 'cycle':
+            # Ordinal 1 is a Monday
+            self.offset = (start.toordinal() if start is not None else 1 + week_start) % days
+
+    def start(self, day):
+        """Return midnight at the start of the period *day* is in"""
+        if self.unit == 'month':
+            return datetime.datetime(day.year, day.month, 1)
+        ordinal = day.toordinal()
+        if self.unit == 'week':
+            ordinal -= (day.weekday() - self.week_start) % 7
+        elif self.unit == 'cycle':
+            ordinal -= (ordinal - self.offset) % self.days
+        return datetime.datetime.fromordinal(ordinal)
+
+    def end(self, day):
+        """Return midnight at the start of the period after the one *day* is in"""
+        start = self.start(day)
+        if self.unit == 'month':
+            if start.month == 12:
+                return datetime.datetime(start.year + 1, 1, 1)
+            return datetime.datetime(start.year, start.month + 1, 1)
+        return start + datetime.timedelta(days={'day': 1, 'week': 7}.get(self.unit, self.days))
+
+    def sum_days(self, days):
+        """Yield a (period start, {project: timedelta}) tuple for each period in
+        *days*, (day, {project: timedelta}) tuples in order
+        """
+        current = end = None
+        for day, project_times in days:
+            if end is None or day >= end:
+                if current is not None:
+                    yield current, dict(totals)
+                current, end = self.start(day), self.end(day)
+                totals = defaultdict(datetime.timedelta)
+            for project, timedelta in project_times.iteritems():
+                totals[project] += timedelta
+        if current is not None:
+            yield current, dict(totals)
+
+
+def parse_period(name, week_start=6, start=None):
+    """Return the Period for *name*: day, week, month, or a number of days such
+    as 14d. Raise ValueError for anything else.
+    """
+    if name in units:
+        return Period(name, week_start)
+    match = cycle_re.match(name)
+    if not match or not int(match.group(1)):
+        raise ValueError('%r is not day, week, month or a number of days like 14d' % name)
+    return Period('cycle', week_start, int(match.group(1)),
+                  _midnight(start) if start is not None else None)
@@ -0,0 +1,310 @@
+"""Daily totals of each text log, kept in sidecars next to it in $CT_HOME.
+
+The rollup holds the seconds spent on each project on each day by the closed
+intervals of a log, with intervals that cross midnight split between the days.
+It is brought up to date whenever a clockout is written, and by summary when the
+log has changed some other way, the same way as the other sidecars: only lines
+appended since the last update are folded in, and a rewritten log is rolled up
+again from the start.
+
+The totals are kept in a shard per year, ``.<name>.rollup-<year>``, so that a
+clockout only rewrites the shard of the year it falls in, however long the log
+is. ``.<name>.rollup`` itself only holds how far the log was rolled up, and the
+offset each shard was written at, so that a shard left behind by an interrupted
+or concurrent update is noticed and the rollup rebuilt.
+
+``rollup_intervals`` turns the totals back into stand-in intervals with the
+standins module. Only days that a --from or --to time falls in the middle of are
+read from the log.
+``ct rollup check`` compares the rollup of each log with the log itself, and
+``ct rollup rebuild`` rolls them up from scratch.
+"""
+
+import bisect
+import datetime
+import logging
+import os
+
+from cuttime import util
+from cuttime.cache import (forget_sidecar, load_state, remove_sidecar, save_state, sidecar_path,
+                           update_sidecar)
+from cuttime.commands import Command, command
+from cuttime.index import range_intervals
+from cuttime.standins import in_range, stand_in_intervals
+from cuttime.util import IntervalParser, parse_clockin
+
+log = logging.getLogger('cuttime.rollup')
+
+rollup_version = 2
+
+one_day = datetime.timedelta(days=1)
+
+# Loaded shards by path, with the mtime they were loaded at
+_shards = {}
+
+
+class MissingShard(Exception):
+    """A shard of the rollup can't be read, or isn't the one the rollup wrote"""
+
+
+def _seconds(timedelta):
+    return timedelta.days * 86400 + timedelta.seconds
+
+
+def _empty_state():
+    # shards: {year: the offset its shard was written at}
+    return dict(shards={}, pending=None, ordered=True, last_clockin=None)
+
+
+def _empty_shard():
+    # days: every day of the year with a total, in order. totals: {day: {project:
+    # seconds}}. odd: closed intervals starting in the year that don't last any
+    # time at all. offset: how far into the log it holds the intervals.
+    return dict(days=[], totals={}, odd=[], offset=0, version=rollup_version)
+
+
+def shard_path(file_path, year):
+    return sidecar_path(file_path, 'rollup-%d' % year)
+
+
+def load_shard(file_path, state, year):
+    """Return the shard of *year* of the rollup *state* of *file_path*, or raise
+    MissingShard if it can't be read
+    """
+    if year not in state['shards']:
+        return _empty_shard()
+    path = shard_path(file_path, year)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        raise MissingShard(path)
+    if path in _shards and _shards[path][0] == mtime:
+        shard = _shards[path][1]
+    else:
+        shard = load_state(path, rollup_version)
+        _shards[path] = (mtime, shard)
+    if shard is None or shard['offset'] != state['shards'][year]:
+        raise MissingShard(path)
+    return shard
+
+
+def add_interval(shard, interval):
+    """Add the closed *interval* to the totals in the shards returned by
+    ``shard(year)``
+    """
+    project, clockin_time, clockout_time = interval
+    if clockin_time >= clockout_time:
+        shard(clockin_time.year)['odd'].append(interval)
+        return
+    day = datetime.datetime(year=clockin_time.year, month=clockin_time.month,
+                            day=clockin_time.day)
+    while clockin_time < clockout_time:
+        next_day = day + one_day
+        day_end = min(clockout_time, next_day)
+        year_shard = shard(day.year)
+        totals = year_shard['totals']
+        if day not in totals:
+            bisect.insort(year_shard['days'], day)
+            totals[day] = {}
+        project_seconds = totals[day]
+        project_seconds[project] = (project_seconds.get(project, 0) +
+                                    _seconds(day_end - clockin_time))
+        day, clockin_time = next_day, day_end
+
+
+def _consume(file_path, state, data, offset):
+    shards = {}
+
+    def shard(year):
+        if year not in shards:
+            shards[year] = load_shard(file_path, state, year)
+        return shards[year]
+
+    parser = IntervalParser([], state['pending'])
+    for line in data.splitlines():
+        if 'clockin' in line:
+            _, clockin_time = parse_clockin(line)
+            if state['last_clockin'] is not None and clockin_time < state['last_clockin']:
+                state['ordered'] = False
+            state['last_clockin'] = clockin_time
+        parser.feed(line)
+    for interval in parser.intervals:
+        add_interval(shard, interval)
+    state['pending'] = parser.pending
+
+    for year, year_shard in shards.iteritems():
+        year_shard['offset'] = state['shards'][year] = offset + len(data)
+        path = shard_path(file_path, year)
+        save_state(path, year_shard)
+        _shards.pop(path, None)
+
+
+def update(file_path):
+    """Bring the rollup of *file_path* up to date and return (state, partial), as
+    returned by cache.update_sidecar
+    """
+    def consume(state, data, offset):
+        _consume(file_path, state, data, offset)
+    return _with_shards(file_path, lambda: update_sidecar(
+        file_path, 'rollup', rollup_version, _empty_state, consume))
+
+
+def _with_shards(file_path, function):
+    """Return ``function()``. If it finds a shard missing, try again with the
+    rollup as saved, as another process may have updated it since this one
+    loaded it, and then with the rollup rebuilt.
+    """
+    for rebuild in (False, True):
+        try:
+            return function()
+        except MissingShard:
+            _shards.clear()
+            if rebuild:
+                remove(file_path)
+            else:
+                forget_sidecar(file_path, 'rollup')
+    return function()
+
+
+def remove(file_path):
+    """Remove the rollup of *file_path*, so that the next update rebuilds it"""
+    remove_sidecar(file_path, 'rollup')
+    directory, prefix = os.path.split(sidecar_path(file_path, 'rollup-'))
+    for name in os.listdir(directory or '.'):
+        if name.startswith(prefix):
+            path = os.path.join(directory, name)
+            _shards.pop(path, None)
+            os.remove(path)
+
+
+def _range_shards(file_path, state, from_time, to_time):
+    years = sorted(state['shards'])
+    if from_time is not None:
+        years = [year for year in years if year >= (from_time - one_day).year and
+                 (to_time is None or year <= to_time.year)]
+    return [load_shard(file_path, state, year) for year in years]
+
+
+def rollup_intervals(file_path, from_time=None, to_time=None):
+    """Return (project, clockin, clockout) tuples standing in for the intervals
+    of *file_path*, which summarize exactly like the intervals themselves for
+    {from_time...to_time}, or None if the rollup can't be used for this log
+    """
+    def load():
+        state, partial = update(file_path)
+        if partial or not state['ordered']:
+            return state, None
+        return state, _range_shards(file_path, state, from_time, to_time)
+    state, shards = _with_shards(file_path, load)
+    if shards is None:
+        # Backdated entries and unterminated lines are left to the raw log
+        return None
+
+    def days():
+        for shard in shards:
+            days, totals = shard['days'], shard['totals']
+            start, end = 0, len(days)
+            if from_time is not None:
+                start = bisect.bisect_left(days, from_time - one_day)
+                if to_time is not None:
+                    end = bisect.bisect_left(days, to_time)
+            for day in days[start:end]:
+                yield day, totals[day]
+
+    intervals = stand_in_intervals(
+        days(), from_time, to_time,
+        lambda day, day_end: range_intervals(file_path, day, day_end, closed_only=True))
+    for shard in shards:
+        intervals.extend(interval for interval in shard['odd']
+                         if in_range(interval, from_time, to_time))
+    if state['pending']:
+        interval = state['pending'] + (util.now,)
+        if in_range(interval, from_time, to_time):
+            intervals.append(interval)
+    return intervals
+
+
+def check(file_path):
+    """Return a list of the differences between the rollup of *file_path* and
+    the totals computed from the log itself
+    """
+    state, partial = update(file_path)
+    problems = []
+    days, totals, odd, missing = [], {}, [], set()
+    for year in sorted(state['shards']):
+        try:
+            shard = load_shard(file_path, state, year)
+        except MissingShard:
+            problems.append('the totals of %d are missing or out of date' % year)
+            missing.add(year)
+            continue
+        if any(day.year != year for day in shard['days']):
+            problems.append('the totals of %d hold other years' % year)
+        days.extend(shard['days'])
+        totals.update(shard['totals'])
+        odd.extend(shard['odd'])
+
+    parser = IntervalParser()
+    with open(file_path, 'rb') as f:
+        for line in f:
+            parser.feed(line)
+
+    expected = dict((day, dict((project, _seconds(t)) for project, t in project_times.iteritems()))
+                    for day, project_times in util.daily_project_times(
+                        i for i in parser.intervals if i[1] < i[2]))
+    for day in sorted(day for day in set(expected) | set(totals) if day.year not in missing):
+        rolled_up, logged = totals.get(day, {}), expected.get(day, {})
+        for project in sorted(set(rolled_up) | set(logged)):
+            if rolled_up.get(project, 0) != logged.get(project, 0):
+                problems.append('%s %s: %d seconds in the rollup, %d in the log' % (
+                    day.strftime('%Y-%m-%d'), project,
+                    rolled_up.get(project, 0), logged.get(project, 0)))
+    if days != sorted(totals):
+        problems.append('the days of the rollup are out of order')
+    if sorted(odd) != sorted(i for i in parser.intervals
+                             if i[1] >= i[2] and i[1].year not in missing):
+        problems.append('the zero-length intervals differ')
+    if not partial and state['pending'] != parser.pending:
+        problems.append('the open interval differs')
+    return problems
+
+
+@command('rollup')
+class RollupCommand(Command):
+
+    description = 'Check the daily totals kept for your log, or rebuild them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', type=str, action='store', default='check', nargs='?',
+                            choices=['check', 'rebuild'],
+                            help='compare the totals with the log (default), or '
+                                 'recompute them from the log')
+        parser.add_argument('--all', dest='all', default=False, action='store_true',
+                            help="use every user's log, not just yours")
+
+    def execute(self, args):
+        if args.all:
+            file_paths = sorted(path for path in util.all_files() if path.endswith('.txt'))
+        else:
+            file_paths = [util.path_for_current_user()]
+
+        for file_path in file_paths:
+            if not os.path.exists(file_path):
+                log.error('%s does not exist.' % file_path)
+                continue
+
+            if args.action == 'rebuild':
+                remove(file_path)
+                state, _ = update(file_path)
+                days = sum(len(load_shard(file_path, state, year)['days'])
+                           for year in state['shards'])
+                log.info('Rebuilt the rollup of %s (%d days)' % (file_path, days))
+                continue
+
+            problems = check(file_path)
+            for problem in problems:
+                log.error('%s: %s' % (file_path, problem))
+            if problems:
+                log.error('Run "ct rollup rebuild%s" to fix it.' % (' --all' if args.all else ''))
+            else:
+                log.info('The rollup of %s matches the log.' % file_path)
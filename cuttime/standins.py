@@ -0,0 +1,56 @@
+"""Stand-ins for the intervals of a log, built from its daily totals.
+
+The rollup of a text log, the totals of archive segments and the SQLite storage
+all know the time spent on each project on each day. ``stand_in_intervals``
+turns those totals back into intervals that summarize exactly like the ones in
+the log: one per project per day, starting at midnight. Only days that a --from
+or --to time falls in the middle of need the real intervals, which each caller
+reads its own way.
+"""
+
+import datetime
+
+one_day = datetime.timedelta(days=1)
+
+
+def in_range(interval, from_time, to_time):
+    """Return True if a time range query on a log would return *interval*.
+
+    Without --from every interval in the log is returned, so days outside the
+    range still count for which projects are listed.
+    """
+    return from_time is None or (interval[2] > from_time and
+                                 (to_time is None or interval[1] < to_time))
+
+
+def stand_in_intervals(days, from_time, to_time, cut_intervals):
+    """Return (project, clockin, clockout) tuples standing in for *days*,
+    (day, {project: seconds}) tuples in order, for {from_time...to_time}.
+
+    For a day that *from_time* or *to_time* cuts in two, ``cut_intervals(day,
+    day_end)`` is called instead, and must return the closed intervals of the
+    log that overlap the day (it may return others too).
+    """
+    intervals = []
+    cuts = [t for t in (from_time, to_time) if t is not None]
+    timedelta = datetime.timedelta
+    for day, project_seconds in days:
+        day_end = day + one_day
+        if cuts and any(day < t < day_end for t in cuts):
+            # A day only partly in the range needs the real intervals
+            for interval in cut_intervals(day, day_end):
+                project, clockin_time, clockout_time = interval
+                if (clockin_time < clockout_time and clockin_time < day_end and
+                        clockout_time > day and in_range(interval, from_time, to_time)):
+                    intervals.append((project, max(clockin_time, day),
+                                      min(clockout_time, day_end)))
+            continue
+        if from_time is not None and not (day >= from_time and
+                                          (to_time is None or day_end <= to_time)):
+            continue
+        for project, seconds in project_seconds.iteritems():
+            while seconds > 86400:
+                intervals.append((project, day, day_end))
+                seconds -= 86400
+            intervals.append((project, day, day + timedelta(seconds=seconds)))
+    return intervals
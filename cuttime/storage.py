@@ -0,0 +1,556 @@
+"""Where the logs are kept, and the one interface ct uses to get at them.
+
+The storage is chosen with "storage" in the config:
+
+    text      a log per user in $CT_HOME, as ``<name>.txt`` (or binary
+              ``<name>.ctb``), with the sidecars and archives of the other
+              modules to speed up reading them. This is the default.
+    sqlite    one SQLite database, ``$CT_HOME/ct.db``, with every user's
+              intervals in a table indexed on (user, clockin) and
+              (project, clockin). ``ct migrate`` moves text logs into it.
+
+Every storage hands out logs by a key of its own (a file path for text, a user
+name for SQLite), and returns the intervals of a log the way summary needs them:
+either the intervals themselves, or stand-ins that summarize exactly like them,
+such as one interval per project per day.
+"""
+
+from abc import ABCMeta, abstractmethod
+from contextlib import contextmanager
+import datetime
+from itertools import groupby
+import logging
+import os
+
+from cuttime import binlog, instrument, util
+from cuttime.standins import in_range, stand_in_intervals
+from cuttime.util import IntervalParser, format_clockin, format_clockout, load_config, parse_clockin
+
+log = logging.getLogger('cuttime.storage')
+
+storage_names = ('text', 'sqlite')
+
+database_name = 'ct.db'
+
+# Storage objects by (name, $CT_HOME, process), so that worker processes of
+# summary --jobs don't share a database connection with their parent
+_storages = {}
+
+
+def database_path():
+    return os.path.join(util.working_directory(), database_name)
+
+
+def storage(name=None):
+    """Return the storage called *name*, by default the one set in the config"""
+    name = name or load_config().get('storage', 'text')
+    key = (name, util.working_directory(), os.getpid())
+    if key not in _storages:
+        if name == 'text':
+            _storages[key] = TextStorage()
+        elif name == 'sqlite':
+            _storages[key] = SQLiteStorage(database_path())
+        else:
+            raise ValueError('Unknown storage %r in %s' % (name, util.config_file_path()))
+    return _storages[key]
+
+
+class Storage(object):
+
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def logs(self):
+        """Return the keys of every user's log, ordered by user"""
+
+    @abstractmethod
+    def user(self, log_id):
+        """Return the name of the user whose log is *log_id*"""
+
+    @abstractmethod
+    def current(self):
+        """Return the key of the current user's log"""
+
+    @abstractmethod
+    def describe(self, log_id):
+        """Return where the log *log_id* is kept, for messages"""
+
+    @abstractmethod
+    def version(self, log_id):
+        """Return a value that changes whenever the log *log_id* does, or None if
+        it no longer exists
+        """
+
+    @abstractmethod
+    def transaction(self):
+        """Return a context manager in which what is read from the current user's
+        log and what is written to it happen without another ct in between
+        """
+
+    @abstractmethod
+    def clocked_in(self, log_id=None):
+        """Return (project, clockin) if the last thing in *log_id* (by default the
+        current user's log) is a clockin, otherwise (None, None)
+        """
+
+    @abstractmethod
+    def last_project(self):
+        """Return the project of the current user's last clockin, or None"""
+
+    @abstractmethod
+    def clockin(self, project, time):
+        """Start an interval on *project* in the current user's log"""
+
+    @abstractmethod
+    def clockout(self, time):
+        """End the open interval in the current user's log"""
+
+    @abstractmethod
+    def entries(self, log_id):
+        """Return (intervals, pending) for everything in *log_id*: every closed
+        (project, clockin, clockout) interval, and the (project, clockin) of the
+        open one, or None
+        """
+
+    @abstractmethod
+    def add_intervals(self, intervals):
+        """Add closed (project, clockin, clockout) *intervals*, sorted by
+        clockin, to the current user's log
+        """
+
+    @abstractmethod
+    def intervals(self, log_id, from_time=None, to_time=None, projects=None):
+        """Return (project, clockin, clockout) tuples that summarize exactly like
+        the intervals of *log_id*. When a range is given, only the intervals that
+        overlap {from_time...to_time} may be returned, and when *projects* is,
+        only intervals on those projects. An open interval ends at now.
+        """
+
+
+def log_entries(data):
+    """Split the text of a log into a list of (clockin time, text) for each
+    clockin line and the lines after it up to the next clockin. Lines before the
+    first clockin get a clockin time of None.
+    """
+    entries = []
+    lines = []
+    time = None
+    for line in data.splitlines(True):
+        project, clockin_time = parse_clockin(line) if ' clockin ' in line else (None, None)
+        if project:
+            if lines:
+                entries.append((time, ''.join(lines)))
+            time, lines = clockin_time, []
+        lines.append(line)
+    if lines:
+        entries.append((time, ''.join(lines)))
+    return entries
+
+
+class TextStorage(Storage):
+    """A text (or binary) log per user in $CT_HOME"""
+
+    def logs(self):
+        return sorted(util.all_files())
+
+    def user(self, log_id):
+        return util.user_for_path(log_id)
+
+    def current(self):
+        # A binary log is the user's log once it has replaced the text one
+        path = util.path_for_current_user()
+        binary_path = os.path.splitext(path)[0] + binlog.binary_extension
+        if not os.path.exists(path) and os.path.exists(binary_path):
+            return binary_path
+        return path
+
+    def describe(self, log_id):
+        return log_id
+
+    def version(self, log_id):
+        try:
+            stat = os.stat(log_id)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime
+
+    def transaction(self):
+        return util.log_transaction(self.current())
+
+    def clocked_in(self, log_id=None):
+        log_id = log_id or self.current()
+        if binlog.is_binary_log(log_id):
+            with binlog.BinaryLog(log_id) as binary_log:
+                if binary_log.open_record < 0:
+                    return None, None
+                project, start, _ = binary_log.record(binary_log.open_record)
+                return project, binlog.from_epoch(start)
+        try:
+            f = open(log_id, 'rb')
+        except IOError:
+            return None, None
+        with f:
+            last_line = next(util.reverse_lines(f), '')
+        if 'clockin' in last_line:
+            return parse_clockin(last_line)
+        return None, None
+
+    def last_project(self):
+        path = self.current()
+        if binlog.is_binary_log(path):
+            with binlog.BinaryLog(path) as binary_log:
+                if not binary_log.record_count:
+                    return None
+                return binary_log.record(binary_log.record_count - 1)[0]
+        return util.last_project()
+
+    def clockin(self, project, time):
+        path = self.current()
+        if binlog.is_binary_log(path):
+            with self.transaction():
+                binlog.write_clockin(path, project, time)
+            return
+        util.write_clockin(project, time)
+
+    def clockout(self, time):
+        path = self.current()
+        with self.transaction():
+            if binlog.is_binary_log(path):
+                binlog.write_clockout(path, time)
+                return
+            util.write_clockout(time)
+
+        # Summaries read closed intervals from the daily rollup. It is only a
+        # cache of the log, which summary brings up to date itself, so the
+        # clockout has still worked if it can't be updated now.
+        from cuttime import rollup
+        try:
+            rollup.update(path)
+        except Exception, e:
+            log.debug("Couldn't update the rollup of %s: %s" % (path, e))
+
+    def entries(self, log_id):
+        from cuttime import archive
+        from cuttime.cache import cached_intervals
+        intervals = []
+        for segment_path in archive.segment_paths(log_id):
+            intervals.extend(cached_intervals(segment_path))
+        if binlog.is_binary_log(log_id):
+            with binlog.BinaryLog(log_id) as binary_log:
+                binary_intervals, pending = binlog.read_all(binary_log)
+            return intervals + binary_intervals, pending
+        parser = IntervalParser(intervals)
+        if os.path.exists(log_id):
+            with open(log_id, 'rb') as f:
+                for line in f:
+                    parser.feed(line)
+        return parser.intervals, parser.pending
+
+    def add_intervals(self, intervals):
+        with self.transaction():
+            path = self.current()
+            if binlog.is_binary_log(path):
+                with binlog.BinaryLog(path) as binary_log:
+                    existing, pending = binlog.read_all(binary_log)
+                binlog.write_binary_log(path, existing + intervals, pending)
+                return
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except IOError:
+                data = ''
+
+            # An unterminated last line must end before anything is added after it
+            separator = '\n' if data and not data.endswith('\n') else ''
+            data += separator
+            new_entries = [(clockin, format_clockin(project, clockin) + format_clockout(clockout))
+                           for project, clockin, clockout in intervals]
+            entries = log_entries(data)
+
+            last_clockin = max([time for time, _ in entries if time is not None] or [None])
+            if last_clockin is None or last_clockin <= intervals[0][1]:
+                # Everything added comes after the log, so it can be appended
+                util.writeln(separator + ''.join(text for _, text in new_entries))
+                return
+
+            # sorted() is stable, so existing entries keep their order among equal
+            # times, and lines before the first clockin stay first
+            entries = sorted(entries + new_entries,
+                             key=lambda entry: (entry[0] is not None, entry[0]))
+            tmp_path = '%s.%d' % (path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                f.write(''.join(text for _, text in entries))
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_path, path)
+
+    def intervals(self, log_id, from_time=None, to_time=None, projects=None):
+        from cuttime.archive import archived_intervals
+        from cuttime.cache import cached_intervals
+        from cuttime.index import range_intervals
+        from cuttime.rollup import rollup_intervals
+
+        if binlog.is_binary_log(log_id):
+            intervals = binlog.read_intervals(log_id, from_time, to_time)
+            instrument.count('intervals', len(intervals))
+            return intervals
+        intervals = rollup_intervals(log_id, from_time, to_time)
+        if intervals is None and from_time is not None:
+            intervals = range_intervals(log_id, from_time, to_time)
+        if intervals is None:
+            intervals = cached_intervals(log_id)
+        # Stand-ins for intervals moved out of the log by ct compact
+        intervals = archived_intervals(log_id, from_time, to_time) + intervals
+        instrument.count('intervals', len(intervals))
+        return intervals
+
+
+def to_seconds(time):
+    """Return *time* in whole seconds since the start of day 1 of the proleptic
+    Gregorian calendar, so that dividing by 86400 gives its ordinal
+    """
+    return time.toordinal() * 86400 + time.hour * 3600 + time.minute * 60 + time.second
+
+
+def from_seconds(seconds):
+    day, seconds = divmod(seconds, 86400)
+    return datetime.datetime.fromordinal(day) + datetime.timedelta(seconds=seconds)
+
+
+def _midnight(time):
+    return time.hour == time.minute == time.second == time.microsecond == 0
+
+
+schema = """
+CREATE TABLE IF NOT EXISTS intervals (
+    user TEXT NOT NULL,
+    project TEXT NOT NULL,
+    clockin INTEGER NOT NULL,
+    clockout INTEGER
+);
+CREATE INDEX IF NOT EXISTS intervals_user_clockin ON intervals (user, clockin);
+CREATE INDEX IF NOT EXISTS intervals_project_clockin ON intervals (project, clockin);
+CREATE INDEX IF NOT EXISTS intervals_open ON intervals (user) WHERE clockout IS NULL;
+CREATE TABLE IF NOT EXISTS users (
+    user TEXT PRIMARY KEY,
+    longest INTEGER NOT NULL DEFAULT 0,
+    revision INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Time spent on each project on each day, from the closed intervals that match
+# {where}, with intervals that cross midnight split between the days
+day_totals_query = """
+WITH RECURSIVE pieces(project, day, clockin, clockout) AS (
+    SELECT project, clockin / 86400, clockin, clockout FROM intervals
+    WHERE %s AND clockout > clockin
+    UNION ALL
+    SELECT project, day + 1, (day + 1) * 86400, clockout FROM pieces
+    WHERE clockout > (day + 1) * 86400)
+SELECT day, project, SUM(MIN(clockout, (day + 1) * 86400) - clockin) FROM pieces
+WHERE %s
+GROUP BY day, project
+ORDER BY day
+"""
+
+
+class SQLiteStorage(Storage):
+    """Every user's intervals in one SQLite database. Times are stored as
+    seconds, as returned by to_seconds, and an open interval has no clockout.
+    The users table holds the longest closed interval of each user, so range
+    queries know how far back an overlapping interval can start, and a revision
+    that goes up with every change.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._depth = 0
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            import sqlite3
+            with instrument.phase('read'):
+                # Transactions are begun and ended explicitly
+                self._connection = sqlite3.connect(self.path, isolation_level=None)
+                self._connection.text_factory = str
+                self._connection.executescript(schema)
+        return self._connection
+
+    def _query(self, sql, params=()):
+        with instrument.phase('read'):
+            return self.connection.execute(sql, params).fetchall()
+
+    def logs(self):
+        return [user for user, in self._query('SELECT user FROM users ORDER BY user')]
+
+    def user(self, log_id):
+        return log_id
+
+    def current(self):
+        return load_config()['name']
+
+    def describe(self, log_id):
+        return '%s in %s' % (log_id, self.path)
+
+    def version(self, log_id):
+        rows = self._query('SELECT revision FROM users WHERE user = ?', (log_id,))
+        return rows[0][0] if rows else None
+
+    @contextmanager
+    def transaction(self):
+        if self._depth:
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+            return
+
+        self.connection.execute('BEGIN IMMEDIATE')
+        self._depth = 1
+        try:
+            yield
+        except:
+            self.connection.execute('ROLLBACK')
+            raise
+        else:
+            self.connection.execute('COMMIT')
+        finally:
+            self._depth = 0
+
+    def _changed(self, user, longest=0):
+        self.connection.execute('INSERT OR IGNORE INTO users (user) VALUES (?)', (user,))
+        self.connection.execute('UPDATE users SET revision = revision + 1, '
+                                'longest = MAX(longest, ?) WHERE user = ?', (longest, user))
+
+    def clocked_in(self, log_id=None):
+        rows = self._query('SELECT project, clockin FROM intervals '
+                           'WHERE user = ? AND clockout IS NULL', (log_id or self.current(),))
+        if not rows:
+            return None, None
+        return rows[0][0], from_seconds(rows[0][1])
+
+    def last_project(self):
+        # Imported intervals can be older than ones added before them
+        rows = self._query('SELECT project FROM intervals WHERE user = ? '
+                           'ORDER BY clockin DESC, rowid DESC LIMIT 1', (self.current(),))
+        return rows[0][0] if rows else None
+
+    def clockin(self, project, time):
+        user = self.current()
+        with self.transaction():
+            # Like a clockin line in a text log, this ends an open interval
+            open_project, clockin_time = self.clocked_in(user)
+            if open_project:
+                self._close(user, to_seconds(clockin_time), to_seconds(time))
+            self.connection.execute('INSERT INTO intervals (user, project, clockin) '
+                                    'VALUES (?, ?, ?)', (user, project, to_seconds(time)))
+            self._changed(user)
+
+    def clockout(self, time):
+        user = self.current()
+        with self.transaction():
+            project, clockin_time = self.clocked_in(user)
+            if project:
+                self._close(user, to_seconds(clockin_time), to_seconds(time))
+
+    def _close(self, user, clockin, clockout):
+        self.connection.execute('UPDATE intervals SET clockout = ? '
+                                'WHERE user = ? AND clockout IS NULL', (clockout, user))
+        self._changed(user, clockout - clockin)
+
+    def entries(self, log_id):
+        intervals, pending = [], None
+        for project, clockin, clockout in self._query(
+                'SELECT project, clockin, clockout FROM intervals WHERE user = ? '
+                'ORDER BY rowid', (log_id,)):
+            if clockout is None:
+                pending = project, from_seconds(clockin)
+            else:
+                intervals.append((project, from_seconds(clockin), from_seconds(clockout)))
+        return intervals, pending
+
+    def add_intervals(self, intervals):
+        self.add_user_intervals(self.current(), intervals)
+
+    def add_user_intervals(self, user, intervals, pending=None):
+        """Add closed *intervals* and an optional open (project, clockin)
+        *pending* interval to the log of *user*
+        """
+        rows = [(user, project, to_seconds(clockin_time), to_seconds(clockout_time))
+                for project, clockin_time, clockout_time in intervals]
+        if pending:
+            rows.append((user, pending[0], to_seconds(pending[1]), None))
+        with self.transaction():
+            self.connection.executemany('INSERT INTO intervals (user, project, clockin, '
+                                        'clockout) VALUES (?, ?, ?, ?)', rows)
+            self._changed(user, max([clockout - clockin for _, _, clockin, clockout in rows
+                                     if clockout is not None] or [0]))
+
+    def remove_user(self, user):
+        """Remove the log of *user*"""
+        with self.transaction():
+            self.connection.execute('DELETE FROM intervals WHERE user = ?', (user,))
+            self.connection.execute('DELETE FROM users WHERE user = ?', (user,))
+
+    def intervals(self, log_id, from_time=None, to_time=None, projects=None):
+        # Daily totals from SQL, turned into stand-ins like those of the rollup
+        where, params = ['user = ?'], [log_id]
+        if projects is not None:
+            where.append('project IN (%s)' % ', '.join('?' * len(projects)))
+            params.extend(projects)
+        rows = self._query('SELECT longest FROM users WHERE user = ?', (log_id,))
+        longest = rows[0][0] if rows else 0
+
+        range_where, range_params = list(where), list(params)
+        day_where, day_params = [], []
+        if from_time is not None:
+            range_where.append('clockin >= ?')
+            range_params.append(to_seconds(from_time) - longest)
+            if to_time is not None:
+                range_where.append('clockin < ?')
+                range_params.append(to_seconds(to_time) + 1)
+            day_where.append('day >= ?')
+            day_params.append(from_time.toordinal())
+            if to_time is not None:
+                day_where.append('day < ?')
+                day_params.append(to_time.toordinal() + (not _midnight(to_time)))
+        rows = self._query(
+            day_totals_query % (' AND '.join(range_where), ' AND '.join(day_where) or '1'),
+            range_params + day_params)
+        days = ((datetime.datetime.fromordinal(ordinal),
+                 dict((project, seconds) for _, project, seconds in day_rows))
+                for ordinal, day_rows in groupby(rows, lambda row: row[0]))
+
+        def cut_intervals(day, day_end):
+            ordinal = day.toordinal()
+            return [(project, from_seconds(clockin), from_seconds(clockout))
+                    for project, clockin, clockout in self._query(
+                        'SELECT project, clockin, clockout FROM intervals WHERE %s AND '
+                        'clockout > clockin AND clockin >= ? AND clockin < ? AND clockout > ?'
+                        % ' AND '.join(where),
+                        params + [ordinal * 86400 - longest, (ordinal + 1) * 86400,
+                                  ordinal * 86400])]
+
+        intervals = stand_in_intervals(days, from_time, to_time, cut_intervals)
+
+        # Intervals that don't last any time at all, and the open one
+        odd_where, odd_params = list(where), list(params)
+        if from_time is not None:
+            odd_where.append('clockin >= ?')
+            odd_params.append(to_seconds(from_time))
+        for project, clockin, clockout in self._query(
+                'SELECT project, clockin, clockout FROM intervals WHERE %s AND '
+                'clockout <= clockin' % ' AND '.join(odd_where), odd_params):
+            interval = (project, from_seconds(clockin), from_seconds(clockout))
+            if in_range(interval, from_time, to_time):
+                intervals.append(interval)
+        for project, clockin in self._query('SELECT project, clockin FROM intervals WHERE %s AND '
+                                            'clockout IS NULL' % ' AND '.join(where), params):
+            interval = (project, from_seconds(clockin), util.now)
+            if in_range(interval, from_time, to_time):
+                intervals.append(interval)
+        instrument.count('intervals', len(intervals))
+        return intervals
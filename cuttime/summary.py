@@ -0,0 +1,576 @@
+"""The summary command, which reports time spent per user, project and day."""
+
+from collections import defaultdict
+from contextlib import contextmanager
+import datetime
+import errno
+from itertools import izip
+import json
+import logging
+import os
+import sys
+import time
+
+from cuttime import periods, storage, util, vectorized
+from cuttime.commands import Command, command
+from cuttime.util import hours_and_minutes, parse_date, parse_date_range_args
+
+log = logging.getLogger('cuttime.commands')
+
+
+@command('summary')
+class SummaryCommand(Command):
+
+    description = 'Count hours spent on a project'
+
+    def __init__(self, *args, **kwargs):
+        super(SummaryCommand, self).__init__(*args, **kwargs)
+        self.format_funcs = dict(pretty=self.format_file_pretty,
+                                 weekly=self.format_file_weekly,
+                                 csv=self.format_file_csv,
+                                 tsv=self.format_file_tsv)
+        self.aggregate_format_funcs = dict(pretty=self.format_aggregate_pretty,
+                                           csv=self.format_aggregate_csv,
+                                           tsv=self.format_aggregate_tsv)
+        self.record_format_funcs = dict(json=self.format_records_json,
+                                        jsonl=self.format_records_jsonl)
+        # What --period adds days up into, if given, and the weeks of --week
+        self.period = None
+        self.weeks = periods.Period('week')
+
+    def add_arguments(self, parser):
+        parser.add_argument('project', type=str,
+                            action='store',  nargs='*')
+
+        parser.add_argument('--from', dest='tfrom', type=str, action='store',
+                            default=None, help='When to start counting')
+
+        parser.add_argument('--to', dest='tto', type=str, action='store',
+                            default=None, help='When to stop counting')
+
+        parser.add_argument('--format', dest='format',
+                            choices=sorted(self.format_funcs.keys() +
+                                           self.record_format_funcs.keys()),
+                            default='pretty')
+
+        parser.add_argument('--week', dest='week', default=False, action='store_true')
+
+        parser.add_argument('--period', dest='period', default=None,
+                            help='add up days into periods: day, week, month, or a number of '
+                                 'days such as 14d. The weekly format groups days by it.')
+
+        parser.add_argument('--period-start', dest='period_start', default=None,
+                            help='first day of one of the periods of a number of days '
+                                 '(default: --from, or a day weeks start on)')
+
+        parser.add_argument('--week-start', dest='week_start', default=None,
+                            help='day weeks start on (default: "week_start" in the config, '
+                                 'or sunday)')
+
+        parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+                            help='number of logs to summarize in parallel')
+
+        parser.add_argument('--aggregate', dest='aggregate', default=False, action='store_true',
+                            help='merge every log into one report by project, day and user')
+
+        parser.add_argument('--engine', dest='engine', default='auto',
+                            choices=vectorized.engines,
+                            help='add up times with NumPy or pure Python (default: NumPy '
+                                 'for long histories, if it is installed)')
+
+        parser.add_argument('--follow', dest='follow', default=False, action='store_true',
+                            help='keep running, and print the summary again when it changes')
+
+        parser.add_argument('--interval', dest='interval', type=float, default=5,
+                            help='seconds between checks of the logs with --follow')
+
+    def _format_timedelta(self, timedelta):
+        hours, minutes = hours_and_minutes(timedelta)
+        min_str = 'minute' if minutes == 1 else 'minutes'
+        if hours == 0:
+            return '%d %s' % (minutes, min_str)
+        else:
+            hour_str = 'hour' if hours == 1 else 'hours'
+            return '%d %s, %d %s' % (hours, hour_str, minutes, min_str)
+
+    def execute(self, args):
+        projects = args.project or None
+        from_time, to_time = parse_date_range_args(args.tfrom, args.tto)
+
+        vectorized.engine = args.engine
+        if args.engine == 'numpy' and vectorized.numpy() is None:
+            log.info("NumPy isn't installed, so times are added up in pure Python.")
+
+        try:
+            week_start = periods.weekday_index(args.week_start or
+                                               util.load_config().get('week_start', 'sunday'))
+            self.weeks = periods.Period('week', week_start)
+            # ct serve runs every summary with the same command
+            self.period = None
+            if args.period:
+                start = parse_date(args.period_start) if args.period_start else from_time
+                self.period = periods.parse_period(args.period, week_start, start)
+        except ValueError, e:
+            log.error(str(e))
+            return
+
+        if args.week:
+            from_time = self.weeks.start(util.now)
+            print from_time.date()
+            format_name = 'weekly'
+        else:
+            format_name = args.format
+
+        if (args.aggregate and format_name not in self.record_format_funcs and
+                format_name not in self.aggregate_format_funcs):
+            log.error('--aggregate only supports the %s formats.' %
+                      ', '.join(sorted(self.aggregate_format_funcs)))
+            return
+
+        if args.follow:
+            try:
+                self.follow(format_name, from_time, to_time, projects, args.aggregate,
+                            args.interval)
+            except KeyboardInterrupt:
+                pass
+            return
+
+        store = storage.storage()
+        log_ids = store.logs()
+
+        # One record per (user, project, day) whether or not --aggregate is given
+        if format_name in self.record_format_funcs:
+            records = self._day_records(log_ids, from_time, to_time, projects, args.jobs)
+            try:
+                self._write_lines(self.record_format_funcs[format_name](records))
+            finally:
+                # Shuts down its workers now, even if writing stopped early
+                records.close()
+            return
+
+        if args.aggregate:
+            totals = self._aggregate(log_ids, from_time, to_time, projects, args.jobs)
+            self._write_lines(self.aggregate_format_funcs[format_name](totals))
+            return
+
+        jobs = [(format_name, log_id, from_time, to_time, projects, self.period, self.weeks)
+                for log_id in log_ids]
+        with _pool(args.jobs) as pool:
+            if pool is not None:
+                results = pool.imap(_log_lines, jobs)
+            else:
+                format_func = self.format_funcs[format_name]
+                results = (format_func(*job[1:5]) for job in jobs)
+
+            for job, lines in izip(jobs, results):
+                self._write_lines([store.user(job[1])])
+
+                self._write_lines(lines)
+
+    def _write_lines(self, lines):
+        write = sys.stdout.write
+        try:
+            for line in lines:
+                write(line + '\n')
+            sys.stdout.flush()
+        except IOError, e:
+            if e.errno != errno.EPIPE:
+                raise
+            # Whatever ct is piped into (head, say) has stopped reading. Send
+            # what is still buffered nowhere, so that exiting doesn't fail too.
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, sys.stdout.fileno())
+            sys.exit(1)
+
+    def follow(self, format_name, from_time, to_time, projects, aggregate, interval):
+        """Print the summary, then check the logs every *interval* seconds and
+        print it again whenever it changes. Only logs that have changed, or that
+        someone is clocked into and so still add up time, are summarized again.
+        With --format jsonl, only the records that changed are printed, and a
+        record with no time at all retracts one that is no longer there.
+        """
+        store = storage.storage()
+        by_record = aggregate or format_name in self.record_format_funcs
+        # {log: (version, clocked in, lines or records)}
+        results = {}
+        printed = None
+        while True:
+            util.now = datetime.datetime.now()
+            current = {}
+            for log_id in store.logs():
+                version = store.version(log_id)
+                if version is None:
+                    # Removed since it was listed
+                    continue
+                result = results.get(log_id)
+                if result is None or result[0] != version or result[1]:
+                    if by_record:
+                        days = self._days(log_id, from_time, to_time)
+                        output = list(self._records(store.user(log_id), days, projects))
+                    else:
+                        output = [store.user(log_id)] + list(
+                            self.format_funcs[format_name](log_id, from_time, to_time,
+                                                           projects))
+                    result = (version, store.clocked_in(log_id)[0] is not None, output)
+                current[log_id] = result
+            results = current
+
+            outputs = [results[log_id][2] for log_id in store.logs() if log_id in results]
+            if format_name == 'jsonl':
+                records = [record for output in outputs for record in output]
+                lines = zip([(user, project, day) for user, project, day, _ in records],
+                            self._json_records(records))
+                printed = printed or {}
+                current_keys = set(record_key for record_key, _ in lines)
+                # Days that no longer have any time, or whose log is gone
+                gone = [record_key for record_key in sorted(printed)
+                        if record_key not in current_keys]
+                self._write_lines(self._json_records(
+                    record_key + (datetime.timedelta(),) for record_key in gone))
+                self._write_lines(line for record_key, line in lines
+                                  if printed.get(record_key) != line)
+                printed = dict(lines)
+            else:
+                if format_name in self.record_format_funcs:
+                    records = (record for output in outputs for record in output)
+                    lines = list(self.record_format_funcs[format_name](records))
+                elif aggregate:
+                    records = (record for output in outputs for record in output)
+                    lines = list(self.aggregate_format_funcs[format_name](
+                        self._sum_records(records)))
+                else:
+                    lines = [line for output in outputs for line in output]
+                if lines != printed:
+                    if sys.stdout.isatty():
+                        # Clear the screen
+                        sys.stdout.write('\x1b[H\x1b[2J')
+                    elif printed is not None:
+                        sys.stdout.write('\n')
+                    self._write_lines(lines)
+                    printed = lines
+            sys.stdout.flush()
+            time.sleep(interval)
+
+    def _day_records(self, log_ids, from_time, to_time, projects, jobs=1):
+        """Yield a (user, project, day, timedelta) tuple for each day in
+        {from_time...to_time} billed to one of *projects*, log by log
+        """
+        log_jobs = [(log_id, from_time, to_time, self.period) for log_id in log_ids]
+        with _pool(jobs) as pool:
+            if pool is not None:
+                results = pool.imap(_log_days, log_jobs)
+            else:
+                results = (self._days(*job[:3]) for job in log_jobs)
+
+            for log_id, days in izip(log_ids, results):
+                for record in self._records(storage.storage().user(log_id), days, projects):
+                    yield record
+
+    def _records(self, user, days, projects):
+        """Yield a (user, project, day, timedelta) tuple for each of one log's
+        (day, {project: timedelta}) tuples billed to one of *projects*
+        """
+        for day, project_times in days:
+            for project in sorted(project_times):
+                if projects is None or project in projects:
+                    yield user, project, day, project_times[project]
+
+    def _aggregate(self, log_ids, from_time, to_time, projects, jobs=1):
+        """Return {(project, day, user): timedelta} for every day in
+        {from_time...to_time} billed to one of *projects* in any of *log_ids*
+        """
+        return self._sum_records(self._day_records(log_ids, from_time, to_time,
+                                                   projects, jobs))
+
+    def _sum_records(self, records):
+        """Return {(project, day, user): timedelta} for (user, project, day,
+        timedelta) *records*
+        """
+        totals = defaultdict(datetime.timedelta)
+        for user, project, day, timedelta in records:
+            totals[(project, day, user)] += timedelta
+        return totals
+
+    def _days(self, log_id, from_time, to_time):
+        intervals = self._intervals(log_id, from_time, to_time)
+        return self._sum_periods(util.daily_project_times(intervals, from_time, to_time),
+                                 self.period)
+
+    def _sum_periods(self, days, period):
+        """Return (day, {project: timedelta}) *days* added up into *period*, if
+        it isn't None
+        """
+        return period.sum_days(days) if period is not None else days
+
+    def _intervals(self, log_id, from_time=None, to_time=None, projects=None):
+        """Return (project, clockin, clockout) tuples that summarize like the
+        intervals of *log_id*, as returned by the storage
+        """
+        return storage.storage().intervals(log_id, from_time, to_time, projects)
+
+    def _daily_times(self, intervals, from_time, to_time, projects, period=None):
+        """Yield a (day, timedelta) tuple for each day in {from_time...to_time} with
+        more than zero hours that is billed to one of *projects*, or for each
+        *period* if one is given
+        """
+        days = util.daily_project_times(intervals, from_time, to_time)
+        for day, project_times in self._sum_periods(days, period):
+            timedelta = sum((t for p, t in project_times.iteritems()
+                             if projects is None or p in projects),
+                            datetime.timedelta(0))
+            if timedelta > datetime.timedelta(0):
+                yield (day, timedelta)
+
+    def _timedelta_to_hours(self, timedelta, round_to_quarters=True):
+        hours = timedelta.days*24 + timedelta.seconds/3600.0
+        if round_to_quarters:
+            hours = round(hours*4)/4
+        return hours
+
+    def format_file_pretty(self, log_id, from_time, to_time, projects):
+        intervals = self._intervals(log_id, from_time, to_time, projects)
+        projects, from_time, to_time = self._file_data(intervals, from_time, to_time, projects)
+
+        days = list(self._sum_periods(util.daily_project_times(intervals, from_time, to_time),
+                                      self.period))
+        # Only these can add something other than their time in the days above
+        odd_intervals = [interval for interval in intervals if interval[1] >= interval[2]]
+
+        total_time = datetime.timedelta()
+        for name in sorted(projects):
+            yield name
+
+            project_days = [(day, project_times[name]) for day, project_times in days
+                            if name in project_times]
+            for line in self.format_project_days(project_days):
+                yield line
+
+            project_time = sum((timedelta for _, timedelta in project_days),
+                               datetime.timedelta())
+            project_time += sum((self.time_in_range(clockin_time, clockout_time,
+                                                    from_time, to_time)
+                                 for project, clockin_time, clockout_time in odd_intervals
+                                 if project == name),
+                                datetime.timedelta())
+            yield '  Total: %s' % self._format_timedelta(project_time)
+            total_time += project_time
+
+        if projects:
+            yield ''
+
+        yield 'Total: %s' % self._format_timedelta(total_time)
+
+    def format_file_weekly(self, log_id, from_time, to_time, projects):
+        intervals = self._intervals(log_id, from_time, to_time, projects)
+        projects, from_time, to_time = self._file_data(intervals, from_time, to_time, projects)
+        # Days under a heading for each --period, by default each week
+        period = self.period or self.weeks
+        day_format = '%a' if period.unit in ('day', 'week') else '%b %d'
+        period_end = None
+        weekly_total = datetime.timedelta()
+        for day, timedelta in self._daily_times(intervals, from_time, to_time, projects):
+            if period_end is None or day >= period_end:
+                if period_end is not None:
+                    yield ('Total: %0.2f\n' %
+                           self._timedelta_to_hours(weekly_total))
+                    weekly_total = datetime.timedelta()
+                period_end = period.end(day)
+                yield ('%s to %s' %
+                       (period.start(day).strftime('%Y-%m-%d'),
+                        (period_end - datetime.timedelta(days=1)).strftime('%Y-%m-%d')))
+            yield ('  %s: %0.2f' % ((day.strftime(day_format),
+                                     self._timedelta_to_hours(timedelta))))
+            weekly_total += timedelta
+        if period_end is not None:
+            yield ('Total: %0.2f' %
+                   self._timedelta_to_hours(weekly_total))
+
+    def format_file_csv(self, log_id, from_time, to_time, projects):
+        return self.format_file_sep(',', log_id, from_time, to_time, projects)
+
+    def format_file_tsv(self, log_id, from_time, to_time, projects):
+        return self.format_file_sep('\t', log_id, from_time, to_time, projects)
+
+    def format_file_sep(self, sep, log_id, from_time, to_time, projects):
+        intervals = self._intervals(log_id, from_time, to_time, projects)
+        projects, from_time, to_time = self._file_data(intervals, from_time, to_time, projects)
+        rows = ((day.strftime('%Y-%m-%d'), '%0.2f' % self._timedelta_to_hours(timedelta))
+                for day, timedelta in self._daily_times(intervals, from_time, to_time, projects,
+                                                        self.period))
+        return util.delimited_lines(rows, sep)
+
+    def format_project_days(self, days):
+        """Yield lines for one project's (day, timedelta) tuples, under month headings
+        if they span more than one month
+        """
+        # Only the first month is held back until it's known whether there is
+        # more than one
+        first_month = []
+        previous_day = None
+        for day, timedelta in days:
+            if previous_day is None:
+                if not first_month or (day.year, day.month) == (first_month[0][0].year,
+                                                                first_month[0][0].month):
+                    first_month.append((day, timedelta))
+                    continue
+                yield first_month[0][0].strftime('  %B %Y')
+                for line in self.format_days(first_month, 4):
+                    yield line
+                previous_day = first_month[-1][0]
+            if (day.year, day.month) != (previous_day.year, previous_day.month):
+                yield day.strftime('  %B %Y')
+            for line in self.format_days([(day, timedelta)], 4):
+                yield line
+            previous_day = day
+        if previous_day is None:
+            for line in self.format_days(first_month, 2):
+                yield line
+
+    def format_days(self, days, indent=2):
+        for day, timedelta in days:
+            time_str = self._format_timedelta(timedelta)
+            yield day.strftime(' '*indent + '%%Y-%%m-%%d: %s' % time_str)
+
+    def format_aggregate_pretty(self, totals):
+        user_projects = defaultdict(lambda: defaultdict(datetime.timedelta))
+        project_sums = defaultdict(datetime.timedelta)
+        for (project, day, user), timedelta in totals.iteritems():
+            user_projects[user][project] += timedelta
+            project_sums[project] += timedelta
+
+        for user, user_sums in sorted(user_projects.items()):
+            yield user
+            for project, timedelta in sorted(user_sums.items()):
+                yield '  %s: %s' % (project, self._format_timedelta(timedelta))
+            yield '  Total: %s' % self._format_timedelta(sum(user_sums.values(),
+                                                             datetime.timedelta()))
+
+        if project_sums:
+            yield ''
+            yield 'Projects'
+            for project, timedelta in sorted(project_sums.items()):
+                yield '  %s: %s' % (project, self._format_timedelta(timedelta))
+            yield ''
+
+        yield 'Total: %s' % self._format_timedelta(sum(project_sums.values(),
+                                                       datetime.timedelta()))
+
+    def format_aggregate_csv(self, totals):
+        return self.format_aggregate_sep(',', totals)
+
+    def format_aggregate_tsv(self, totals):
+        return self.format_aggregate_sep('\t', totals)
+
+    def format_aggregate_sep(self, sep, totals):
+        # By day, then user, then project
+        keys = sorted(totals, key=lambda (project, day, user): (day, user, project))
+        rows = ((day.strftime('%Y-%m-%d'), user, project,
+                 '%0.2f' % self._timedelta_to_hours(totals[(project, day, user)]))
+                for project, day, user in keys)
+        return util.delimited_lines(rows, sep)
+
+    def _json_records(self, records):
+        """Yield a JSON object for each (user, project, day, timedelta) record"""
+        # Users and projects repeat on nearly every record, so only encode them once
+        encoded = {}
+        for user, project, day, timedelta in records:
+            for name in (user, project):
+                if name not in encoded:
+                    encoded[name] = json.dumps(name)
+            yield ('{"user": %s, "project": %s, "date": "%s", "seconds": %d, "hours": %0.2f}' %
+                   (encoded[user], encoded[project], day.strftime('%Y-%m-%d'),
+                    timedelta.days * 86400 + timedelta.seconds,
+                    self._timedelta_to_hours(timedelta)))
+
+    def format_records_jsonl(self, records):
+        return self._json_records(records)
+
+    def format_records_json(self, records):
+        yield '['
+        previous = None
+        for record in self._json_records(records):
+            if previous is not None:
+                yield '  %s,' % previous
+            previous = record
+        if previous is not None:
+            yield '  %s' % previous
+        yield ']'
+
+    def _file_data(self, intervals, from_time=None, to_time=None, projects=None):
+        """Given a log's intervals and user-supplied parameters, return (projects,
+        from_time, to_time), where projects is a set, and from_time and to_time are
+        datetime objects. No return value will be None.
+        """
+        scraped_projects = set()
+        min_datetime = None
+        max_datetime = None
+        for this_proj, clockin_time, clockout_time in intervals:
+            if projects is None or this_proj in projects:
+                scraped_projects.add(this_proj)
+
+                if min_datetime is None:
+                    min_datetime = clockin_time
+                else:
+                    min_datetime = min(min_datetime, clockin_time)
+
+                if max_datetime is None:
+                    max_datetime = clockout_time
+                else:
+                    max_datetime = max(max_datetime, clockout_time)
+        if None in (min_datetime, max_datetime):
+            new_from, new_to = util.now, util.now
+        else:
+            new_from, new_to = min_datetime, max_datetime
+        if from_time is None or new_from > from_time:
+            from_time = new_from
+        if to_time is None or new_to < to_time:
+            to_time = new_to
+        return scraped_projects, from_time, to_time
+
+    def time_in_range(self, clockin_time, clockout_time, from_time, to_time):
+        if from_time is not None:
+            if clockout_time <= from_time:
+                return datetime.timedelta(0)
+            clockin_time = max(clockin_time, from_time)
+
+        if to_time is not None:
+            if clockin_time >= to_time:
+                return datetime.timedelta(0)
+            clockout_time = min(clockout_time, to_time)
+
+        return clockout_time - clockin_time
+
+
+@contextmanager
+def _pool(jobs):
+    """Yield a multiprocessing pool of *jobs* processes, or None for one job, and
+    wait for its workers afterwards, even if summary stopped early
+    """
+    if jobs <= 1:
+        yield None
+        return
+    from multiprocessing import Pool
+    pool = Pool(jobs)
+    try:
+        yield pool
+    finally:
+        # Pool.terminate() can hang while results are still queued
+        pool.close()
+        pool.join()
+
+
+def _log_days(job):
+    """Return a log's (day, {project: timedelta}) tuples in a worker process"""
+    log_id, from_time, to_time, period = job
+    command = SummaryCommand()
+    command.period = period
+    return list(command._days(log_id, from_time, to_time))
+
+
+def _log_lines(job):
+    """Summarize one log in a worker process"""
+    format_name, log_id, from_time, to_time, projects, period, weeks = job
+    command = SummaryCommand()
+    command.period, command.weeks = period, weeks
+    format_func = command.format_funcs[format_name]
+    return list(format_func(log_id, from_time, to_time, projects))
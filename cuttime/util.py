@@ -1,14 +1,17 @@
+from collections import defaultdict
 from contextlib import contextmanager
+import csv
 import datetime
+import errno
+import fcntl
 import json
 import logging
+from operator import itemgetter
 import os
-import platform
 import re
-from subprocess import Popen, PIPE
 import sys
 
-from dateutil.parser import parse as parse_date
+from cuttime import instrument, vectorized
 
 log = logging.getLogger('cuttime.commands')
 
@@ -26,6 +29,10 @@ def working_directory():
 def config_file_path():
     return os.path.join(working_directory(), 'config')
 
+def socket_path():
+    """Return the path of the socket ct serve listens on"""
+    return os.path.join(working_directory(), '.ct.sock')
+
 @contextmanager
 def config(mode='r'):
     """Convenient way to read the config file"""
@@ -48,6 +55,7 @@ def prompt_name():
 
 def prompt_location():
     """Ask the user for his location"""
+    import platform
     location = ''
     while not location:
         location = raw_input('Your current location (e.g. work laptop, basement tower, %s):\n' %
@@ -55,16 +63,35 @@ def prompt_location():
     return location
 
 def prompt_adium():
-    if platform.system() != 'Darwin':
+    if sys.platform != 'darwin':
         return False
     adium = '!!!'
     while adium not in 'YyNn':
         adium = raw_input('Change Adium status on clockin/clockout (y/n):\n')
     return adium in 'Yy'
 
+# The config as of the last load_config(), and the (path, mtime, size) of the
+# file it came from. ct reads the config from several places per command, so it
+# is only parsed again if the file has changed since.
+_config = None
+_config_key = None
+
+def _config_file_key():
+    path = config_file_path()
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return path, None, None
+    return path, stat.st_mtime, stat.st_size
+
 def load_config(reset=False):
     """Load or create the config file"""
-    if reset or not os.path.exists(config_file_path()):
+    global _config, _config_key
+    key = _config_file_key()
+    if not reset and _config is not None and key == _config_key:
+        return _config
+
+    if reset or key[1] is None:
         c = {}
     else:
         with config() as conf:
@@ -78,18 +105,85 @@ def load_config(reset=False):
         c['location'] = prompt_location()
     if 'adium' not in c or c['adium'] not in (True, False):
         c['adium'] = prompt_adium()
-    c['adium'] = c['adium'] and platform.system() == 'Darwin'
+    c['adium'] = c['adium'] and sys.platform == 'darwin'
 
     if c != original_conf:
         with config('w') as conf:
             json.dump(c, conf)
+        key = _config_file_key()
 
+    _config, _config_key = c, key
     return c
 
 ### Parsing ###
 
+# Recently parsed timestamps. Clockouts are often followed by a clockin at the
+# same second, so even a small memo saves a lot of parsing.
+_parsed_dates = {}
+_parsed_dates_max = 512
+
+def _parse_file_date(date_string):
+    """Parse a timestamp in *file_date_format* by slicing out its fixed-width
+    fields, falling back to strptime for anything that doesn't look exactly like
+    'mm-dd-YYYY HH:MM:SS'
+    """
+    s = date_string
+    if len(s) == 19 and s[2] + s[5] + s[10] + s[13] + s[16] == '-- ::':
+        digits = s[0:2] + s[3:5] + s[6:10] + s[11:13] + s[14:16] + s[17:19]
+        if digits.isdigit():
+            # mmddYYYYHHMMSS as one number
+            n = int(digits)
+            try:
+                return datetime.datetime(n // 1000000 % 10000, n // 1000000000000,
+                                         n // 10000000000 % 100, n // 10000 % 100,
+                                         n // 100 % 100, n % 100)
+            except ValueError:
+                pass
+    return datetime.datetime.strptime(s, file_date_format)
+
 def parse_date_from_file(date_string):
-    return datetime.datetime.strptime(date_string.strip(), file_date_format)
+    date_string = date_string.strip()
+    try:
+        return _parsed_dates[date_string]
+    except KeyError:
+        pass
+    if len(_parsed_dates) >= _parsed_dates_max:
+        _parsed_dates.clear()
+    result = _parsed_dates[date_string] = _parse_file_date(date_string)
+    return result
+
+# Formats common enough in --time, --from and --to to parse without dateutil,
+# which is slow to import
+user_date_formats = ('%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S',
+                     '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S')
+
+def _parse_iso_date(s):
+    """Parse 'YYYY-mm-dd HH:MM:SS' or 'YYYY-mm-ddTHH:MM:SS' by slicing, or
+    return None for anything else
+    """
+    if len(s) == 19 and s[4] + s[7] + s[13] + s[16] == '--::' and s[10] in ' T':
+        digits = s[0:4] + s[5:7] + s[8:10] + s[11:13] + s[14:16] + s[17:19]
+        if digits.isdigit():
+            try:
+                return datetime.datetime(int(digits[0:4]), int(digits[4:6]),
+                                         int(digits[6:8]), int(digits[8:10]),
+                                         int(digits[10:12]), int(digits[12:14]))
+            except ValueError:
+                pass
+    return None
+
+def parse_date(date_string):
+    """Parse a date given on the command line"""
+    result = _parse_iso_date(date_string)
+    if result is not None:
+        return result
+    for date_format in user_date_formats:
+        try:
+            return datetime.datetime.strptime(date_string, date_format)
+        except ValueError:
+            pass
+    from dateutil.parser import parse
+    return parse(date_string)
 
 def parse_date_range_args(tfrom, tto):
     from_time = parse_date(tfrom) if tfrom else None
@@ -105,11 +199,100 @@ def parse_clockin(line):
 def parse_clockout(line):
     return parse_date_from_file(line.split('clockout ', 1)[1].strip())
 
+def format_clockin(project, time):
+    return '%s clockin %s\n' % (project, time.strftime(file_date_format))
+
+def format_clockout(time):
+    return 'clockout %s\n' % (time.strftime(file_date_format))
+
 def write_clockin(project, time):
-    writeln('%s clockin %s\n' % (project, time.strftime(file_date_format)))
+    writeln(format_clockin(project, time))
 
 def write_clockout(time):
-    writeln('clockout %s\n' % (time.strftime(file_date_format)))
+    writeln(format_clockout(time))
+
+class IntervalParser(object):
+    """Pair up clockin and clockout lines into (project, clockin, clockout) tuples.
+    Lines can be fed in over several calls, so parsing can pick up where it left
+    off after more lines are appended to a log.
+    """
+
+    def __init__(self, intervals=None, pending=None):
+        self.intervals = intervals if intervals is not None else []
+        # (project, clockin) of the interval that has not been clocked out of yet
+        self.pending = pending
+
+    def feed(self, line):
+        if 'clockin' in line:
+            project, clockin_time = parse_clockin(line)
+            if self.pending:
+                self.intervals.append(self.pending + (clockin_time,))
+            self.pending = (project, clockin_time)
+        elif line.startswith('clockout ') and self.pending:
+            self.intervals.append(self.pending + (parse_clockout(line),))
+            self.pending = None
+
+    def copy(self):
+        return IntervalParser(list(self.intervals), self.pending)
+
+    def all_intervals(self):
+        """Return every interval, ending an open one at *now*"""
+        if self.pending:
+            return self.intervals + [self.pending + (now,)]
+        return list(self.intervals)
+
+def daily_project_times(intervals, from_time=None, to_time=None):
+    """Clip *intervals* to {from_time...to_time} and split them at midnight.
+    Yield a (day, {project: timedelta}) tuple for each day with more than zero
+    hours, in order. Intervals are swept by clockin time, so a day is yielded as
+    soon as no later interval can add to it. Many intervals are summed all at
+    once with NumPy instead, if it is installed.
+    """
+    if not isinstance(intervals, list):
+        intervals = list(intervals)
+    if vectorized.use_numpy(len(intervals)):
+        with instrument.phase('clip'):
+            return vectorized.daily_project_times(intervals, from_time, to_time)
+    return instrument.timed('clip', _daily_project_times(intervals, from_time, to_time))
+
+def _daily_project_times(intervals, from_time, to_time):
+    one_day = datetime.timedelta(days=1)
+    days = defaultdict(lambda: defaultdict(datetime.timedelta))
+    for project, clockin_time, clockout_time in sorted(intervals, key=itemgetter(1)):
+        if from_time is not None:
+            clockin_time = max(clockin_time, from_time)
+        if to_time is not None:
+            clockout_time = min(clockout_time, to_time)
+        if clockin_time >= clockout_time:
+            continue
+        day = datetime.datetime(year=clockin_time.year,
+                                month=clockin_time.month,
+                                day=clockin_time.day)
+        for finished_day in sorted(d for d in days if d < day):
+            yield finished_day, days.pop(finished_day)
+        while clockin_time < clockout_time:
+            next_day = day + one_day
+            day_end = min(clockout_time, next_day)
+            days[day][project] += day_end - clockin_time
+            day, clockin_time = next_day, day_end
+    for finished_day in sorted(days):
+        yield finished_day, days[finished_day]
+
+class _LastLine(object):
+    """File-like object that only remembers the last thing written to it"""
+
+    def write(self, line):
+        self.line = line
+
+def delimited_lines(rows, delimiter=','):
+    """Yield each row in *rows* as a line of CSV with *delimiter* between fields,
+    quoting fields as needed
+    """
+    last_line = _LastLine()
+    writer = csv.writer(last_line, delimiter=delimiter, lineterminator='')
+    for row in rows:
+        writer.writerow(row)
+        yield last_line.line
 
 def hours_and_minutes(timedelta):
     s = timedelta.seconds
@@ -121,50 +304,142 @@ def hours_and_minutes(timedelta):
 
 ### Files ###
 
+def path_for_current_user():
+    return os.path.join(working_directory(), '%s.txt' % load_config()['name'])
+
 @contextmanager
 def file_for_current_user(mode='r'):
     """Return the file corresponding to the current user"""
-    config = load_config()
-    path = os.path.join(working_directory(), '%s.txt' % config['name'])
-    if mode == 'r' and not os.path.exists(path):
+    path = path_for_current_user()
+    try:
+        f = open(path, mode)
+    except IOError, e:
+        if mode.startswith('r') and e.errno == errno.ENOENT:
+            f = None
+        else:
+            raise
+    if f is None:
         yield None
     else:
-        with open(path, mode) as f:
+        with f:
             yield f
 
+def reverse_lines(f, block_size=4096):
+    """Yield the non-blank lines of *f* from last to first, reading backwards from
+    the end of the file *block_size* bytes at a time
+    """
+    f.seek(0, os.SEEK_END)
+    position = f.tell()
+    remainder = ''
+    while position > 0:
+        read_size = min(block_size, position)
+        position -= read_size
+        f.seek(position)
+        lines = (f.read(read_size) + remainder).split('\n')
+        # The first piece may be the end of a line that starts in an earlier block
+        remainder = lines.pop(0)
+        for line in reversed(lines):
+            if line.strip():
+                yield line
+    if remainder.strip():
+        yield remainder
+
+def file_intervals(file_path):
+    """Return a list of (project, clockin, clockout) tuples for *file_path*"""
+    parser = IntervalParser()
+    lines = size = 0
+    with instrument.phase('parse'), open(file_path, 'r') as f:
+        for line in f:
+            lines += 1
+            size += len(line)
+            parser.feed(line)
+    instrument.count('lines parsed', lines)
+    instrument.count('bytes read', size)
+    return parser.all_intervals()
+
+def user_for_path(file_path):
+    """Return the name of the user whose log is at *file_path*"""
+    return os.path.split(os.path.splitext(file_path)[0])[1]
+
 def all_files():
+    """Return the path of every user's log, text (.txt) or binary (.ctb). A user
+    with both has the text one returned, since that is the one written to.
+    """
     wd = working_directory()
-    return (os.path.join(wd, path) for path in os.listdir(wd)
-            if path.endswith('.txt')
-               and not os.path.isdir(path))
+    names = set(path for path in os.listdir(wd)
+                if (path.endswith('.txt') or path.endswith('.ctb'))
+                   and not os.path.isdir(os.path.join(wd, path)))
+    return (os.path.join(wd, path) for path in names
+            if not (path.endswith('.ctb') and path[:-len('.ctb')] + '.txt' in names))
+
+### Writing ###
+
+# The transaction on the current user's log in progress in this process, if any
+_transaction = None
+
+@contextmanager
+def log_transaction(path=None):
+    """Hold an exclusive lock on the log at *path* (by default the current
+    user's), so that what is read from it and what is appended to it happen
+    without another ct in between. Transactions can be nested. If "fsync" is set
+    in the config, everything written in the outermost transaction is synced to
+    disk once, at its end.
+    """
+    global _transaction
+    if _transaction is not None:
+        _transaction['depth'] += 1
+        try:
+            yield
+        finally:
+            _transaction['depth'] -= 1
+        return
+
+    path = path or path_for_current_user()
+    lock_path = os.path.join(os.path.dirname(path),
+                             '.%s.lock' % os.path.splitext(os.path.basename(path))[0])
+    lock_fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0644)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        _transaction = dict(depth=0, path=path, fd=None)
+        try:
+            yield
+            if _transaction['fd'] is not None and load_config().get('fsync'):
+                os.fsync(_transaction['fd'])
+        finally:
+            if _transaction['fd'] is not None:
+                os.close(_transaction['fd'])
+            _transaction = None
+    finally:
+        os.close(lock_fd)
 
 def writeln(line):
-    """Write a line to the current user's file"""
-    with file_for_current_user('a') as f:
-        f.write(line)
+    """Append a line to the current user's file. Each line is written with one
+    write() to a file opened with O_APPEND, so lines written by different
+    processes never interleave.
+    """
+    with log_transaction():
+        if _transaction['fd'] is None:
+            _transaction['fd'] = os.open(_transaction['path'],
+                                         os.O_RDWR | os.O_APPEND | os.O_CREAT, 0644)
+        fd = _transaction['fd']
+        line = line.encode('utf-8') if isinstance(line, unicode) else line
+        # An unterminated last line must end before anything is added after it
+        size = os.lseek(fd, 0, os.SEEK_END)
+        if size:
+            os.lseek(fd, size - 1, os.SEEK_SET)
+            if os.read(fd, 1) != '\n':
+                line = '\n' + line
+        if os.write(fd, line) != len(line):
+            raise IOError('Short write to %s' % _transaction['path'])
 
 ### Miscellaneous ###
 
 def last_project():
-    with file_for_current_user() as f:
+    with file_for_current_user('rb') as f:
         if f:
-            lines = f.readlines()
-            lines.reverse()
-            for line in lines:
+            for line in reverse_lines(f):
                 project, _ = parse_clockin(line)
                 if project:
                     return project
     return None
 
-
-def set_adium_status(new_status, away=False):
-    s = Popen(["ps", "axw"], stdout=PIPE)
-    for line in s.stdout:
-        if 'Adium' in line:
-            away_str = "away" if away else "available"
-            p = Popen(['osascript', '-e',
-                       ('tell app "Adium" to go %(away_str)s with message "%(new_status)s"' %
-                        locals())])
-            p.communicate()
-            return True
-    return False
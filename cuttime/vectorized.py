@@ -0,0 +1,113 @@
+"""NumPy version of the summary math, for long histories.
+
+``daily_project_times`` gives exactly the same days and totals as
+``util.daily_project_times``, but clips and splits every interval at once:
+intervals become arrays of clockin and clockout times in microseconds and
+project codes, intervals that cross midnight are repeated once per day, and the
+time of each (day, project) is summed with one ``bincount``.
+
+NumPy takes a while to import, so by default (the "auto" engine) it is only used
+for many intervals, or when something has imported it already, as in a
+long-running ct serve. Without NumPy everything is done in pure Python.
+"""
+
+import datetime
+from itertools import count, imap
+from operator import itemgetter
+import sys
+
+# 'auto', 'numpy' or 'python'
+engine = 'auto'
+
+engines = ('auto', 'numpy', 'python')
+
+# Number of intervals from which the auto engine uses NumPy, depending on
+# whether importing it is still to be paid for
+auto_threshold = 50000
+auto_threshold_imported = 200
+
+_numpy = None
+
+day_us = 86400 * 10 ** 6
+
+
+def numpy():
+    """Return the numpy module, or None if it isn't installed"""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+
+def use_numpy(count):
+    """Return True if *count* intervals should be summed with NumPy"""
+    if engine == 'python':
+        return False
+    if engine == 'auto':
+        threshold = auto_threshold_imported if 'numpy' in sys.modules else auto_threshold
+        if count < threshold:
+            return False
+    return numpy() is not None
+
+
+def _to_us(np, times):
+    """Return an array of *times* in microseconds since the start of day 1 of the
+    proleptic Gregorian calendar, so that dividing by day_us gives ordinals
+    """
+    # Much faster than having NumPy convert datetimes to datetime64
+    return np.array([(t.toordinal() * 86400 + t.hour * 3600 + t.minute * 60 + t.second) *
+                     1000000 + t.microsecond for t in times], dtype=np.int64)
+
+
+def daily_project_times(intervals, from_time=None, to_time=None):
+    """Return what util.daily_project_times yields for *intervals*, as a list"""
+    np = numpy()
+    if not intervals:
+        return []
+    # Codes only need to be distinct, not consecutive
+    names = {}
+    codes = np.fromiter(imap(names.setdefault, imap(itemgetter(0), intervals), count()),
+                        np.int64, len(intervals))
+    starts = _to_us(np, map(itemgetter(1), intervals))
+    ends = _to_us(np, map(itemgetter(2), intervals))
+
+    if from_time is not None:
+        starts = np.maximum(starts, _to_us(np, [from_time])[0])
+    if to_time is not None:
+        ends = np.minimum(ends, _to_us(np, [to_time])[0])
+    keep = starts < ends
+    starts, ends, codes = starts[keep], ends[keep], codes[keep]
+    if not len(starts):
+        return []
+
+    # One segment per day each interval touches
+    first_days = starts // day_us
+    day_counts = (ends - 1) // day_us - first_days + 1
+    index = np.repeat(np.arange(len(starts)), day_counts)
+    segment_days = first_days[index] + (np.arange(len(index)) -
+                                        np.repeat(np.cumsum(day_counts) - day_counts,
+                                                  day_counts))
+    durations = (np.minimum(ends[index], (segment_days + 1) * day_us) -
+                 np.maximum(starts[index], segment_days * day_us))
+
+    # Sums of whole microseconds stay exact in float64 for thousands of years
+    code_count = len(intervals)
+    keys, inverse = np.unique(segment_days * code_count + codes[index], return_inverse=True)
+    totals = np.bincount(inverse, weights=durations).astype(np.int64)
+
+    project_names = dict((code, name) for name, code in names.iteritems())
+    timedelta = datetime.timedelta
+    days = []
+    current_day = None
+    for ordinal, code, total in zip((keys // code_count).tolist(),
+                                    (keys % code_count).tolist(), totals.tolist()):
+        if ordinal != current_day:
+            current_day = ordinal
+            project_times = {}
+            days.append((datetime.datetime.fromordinal(ordinal), project_times))
+        project_times[project_names[code]] = timedelta(0, 0, total)
+    return days